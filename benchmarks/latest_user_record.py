@@ -0,0 +1,218 @@
+import argparse
+import io
+import json
+import random
+import time
+import urllib.request
+
+
+# the two forms of "most recent record of every user", the self join on MAX(ts) that project-3 user_table_insert
+# and project-4 users_temp used before, and the single pass ROW_NUMBER window that replaced them
+
+SELF_JOIN_SELECT = ("""
+select 	s1.userId as user_id,
+		s1.firstname,
+        s1.lastname,
+        s1.gender,
+        s1.level
+	from bench_events s1
+	inner join (
+      select  userId,
+              MAX(TIMESTAMP 'epoch' + ts/1000 * interval '1 second') as most_recent_time
+          from bench_events
+          group by userId
+	) s2
+    	on  s2.userId = s1.userId
+        and s2.most_recent_time = TIMESTAMP 'epoch' + s1.ts/1000 * interval '1 second'
+""")
+
+WINDOW_SELECT = ("""
+select 	user_id,
+		first_name,
+        last_name,
+        gender,
+        level
+	from (
+      select  userId as user_id,
+              firstName as first_name,
+              lastName as last_name,
+              gender,
+              level,
+              ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) as recency
+          from bench_events
+          where userId is not null
+    ) latest
+    where recency = 1
+""")
+
+bench_events_create = ("""
+CREATE TEMP TABLE bench_events (
+  userId   	BIGINT,
+  firstName	VARCHAR(256),
+  lastName  VARCHAR(256),
+  gender   	VARCHAR(1),
+  level   	VARCHAR(256),
+  ts   		BIGINT
+)
+""")
+
+# bytes moved between slices by the last query, Redshift only
+shuffle_bytes_select = ("""
+select  coalesce(sum(bytes), 0)
+    from svl_query_summary
+    where query = pg_last_query_id()
+    and (label like 'dist%' or label like 'bcast%')
+""")
+
+# 2018-11-01 00:00:00 in milliseconds, the first day of the Sparkify log data
+EPOCH_MS = 1541030400000
+
+
+def synthetic_events(num_events, num_users, seed=0):
+    """Generate (userId, firstName, lastName, gender, level, ts) events.
+
+    Timestamps fall on whole seconds often enough that users get several events in the same second,
+    which is where the self join returns more than one row per user.
+    """
+    rng = random.Random(seed)
+    span_ms = max(1, num_events // 4) * 1000
+    for _ in range(num_events):
+        user_id = rng.randrange(num_users)
+        ts = EPOCH_MS + rng.randrange(span_ms)
+        if rng.random() < 0.5:
+            ts -= ts % 1000
+        yield (user_id, 'first{}'.format(user_id), 'last{}'.format(user_id), 'MF'[user_id % 2],
+               rng.choice(['free', 'paid']), ts)
+
+
+def run_sql(dsn, sizes, users_per_event, redshift):
+    """Time both forms on a temp table of synthetic events for every size"""
+    import psycopg2
+    conn = psycopg2.connect(dsn)
+    cur = conn.cursor()
+    results = []
+    for size in sizes:
+        cur.execute('DROP TABLE IF EXISTS bench_events')
+        cur.execute(bench_events_create)
+        num_users = max(1, int(size * users_per_event))
+        if redshift:
+            # Redshift has no COPY FROM STDIN, insert in multi row statements
+            rows = list(synthetic_events(size, num_users))
+            for i in range(0, len(rows), 10000):
+                args = ','.join(cur.mogrify('(%s,%s,%s,%s,%s,%s)', row).decode('utf8') for row in rows[i:i + 10000])
+                cur.execute('INSERT INTO bench_events VALUES ' + args)
+        else:
+            buffer = io.StringIO(''.join('\t'.join(map(str, row)) + '\n' for row in synthetic_events(size, num_users)))
+            cur.copy_expert('COPY bench_events FROM STDIN', buffer)
+        conn.commit()
+
+        for form, query in [('self_join', SELF_JOIN_SELECT), ('window', WINDOW_SELECT)]:
+            start = time.perf_counter()
+            cur.execute('select count(*), count(distinct user_id) from ({}) q'.format(query))
+            rows, users = cur.fetchone()
+            seconds = time.perf_counter() - start
+            shuffle = None
+            if redshift:
+                cur.execute(shuffle_bytes_select)
+                shuffle = cur.fetchone()[0]
+            results.append({'engine': 'sql', 'form': form, 'events': size, 'users': users,
+                            'rows': rows, 'seconds': seconds, 'shuffle_bytes': shuffle})
+    conn.close()
+    return results
+
+
+def stage_shuffle_bytes(spark):
+    """Sum the shuffle write bytes of every stage of the application from the Spark REST api"""
+    url = '{}/api/v1/applications/{}/stages'.format(spark.sparkContext.uiWebUrl, spark.sparkContext.applicationId)
+    with urllib.request.urlopen(url) as response:
+        return sum(stage.get('shuffleWriteBytes', 0) for stage in json.load(response))
+
+
+def run_spark(sizes, users_per_event, shuffle_partitions):
+    """Time both forms on a dataframe of synthetic events for every size"""
+    from pyspark.sql import SparkSession, Window
+    from pyspark.sql import functions as F
+
+    spark = SparkSession.builder \
+        .master('local[*]') \
+        .appName('latest user record benchmark') \
+        .config('spark.sql.shuffle.partitions', shuffle_partitions) \
+        .config('spark.sql.adaptive.enabled', 'false') \
+        .getOrCreate()
+
+    results = []
+    for size in sizes:
+        num_users = max(1, int(size * users_per_event))
+        span_ms = max(1, size // 4) * 1000
+        ts = F.lit(EPOCH_MS) + (F.rand(1) * span_ms).cast('long')
+        # spread the events over several partitions, a single partition needs no shuffle at all
+        df = spark.range(0, size, 1, shuffle_partitions) \
+            .withColumn('userId', (F.rand(0) * num_users).cast('long').cast('string')) \
+            .withColumn('ts', F.when(F.rand(2) < 0.5, ts - ts % 1000).otherwise(ts)) \
+            .withColumn('firstName', F.concat(F.lit('first'), 'userId')) \
+            .withColumn('lastName', F.concat(F.lit('last'), 'userId')) \
+            .withColumn('gender', F.lit('F')) \
+            .withColumn('level', F.when(F.rand(3) < 0.5, 'free').otherwise('paid')) \
+            .drop('id') \
+            .cache()
+        df.count()
+
+        # the sides are aliased, Spark 3 rejects the unaliased self join as ambiguous
+        users_temp = df.groupBy('userId').max('ts').select('userId', F.col('max(ts)').alias('max_ts')).alias('u')
+        self_join = df.alias('e').join(users_temp, [F.col('e.userId') == F.col('u.userId'), F.col('e.ts') == F.col('u.max_ts')]) \
+            .select(F.col('e.userId').alias('user_id'), 'e.firstName', 'e.lastName', 'e.gender', 'e.level')
+
+        latest = Window.partitionBy('userId').orderBy(F.col('ts').desc())
+        window = df.withColumn('recency', F.row_number().over(latest)) \
+            .filter(F.col('recency') == 1) \
+            .select(F.col('userId').alias('user_id'), 'firstName', 'lastName', 'gender', 'level')
+
+        for form, users_table in [('self_join', self_join), ('window', window)]:
+            shuffle_before = stage_shuffle_bytes(spark)
+            start = time.perf_counter()
+            row = users_table.agg(F.count('*'), F.countDistinct('user_id')).collect()[0]
+            seconds = time.perf_counter() - start
+            results.append({'engine': 'spark', 'form': form, 'events': size, 'users': row[1],
+                            'rows': row[0], 'seconds': seconds,
+                            'shuffle_bytes': stage_shuffle_bytes(spark) - shuffle_before})
+        df.unpersist()
+    spark.stop()
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the self join and window forms of the latest user record')
+    parser.add_argument('--engine', choices=['sql', 'spark'], action='append',
+                        help='engines to run, both when not given')
+    parser.add_argument('--sizes', type=int, nargs='+', default=[10000, 100000, 1000000],
+                        help='number of synthetic events of every run')
+    parser.add_argument('--users-per-event', type=float, default=0.01,
+                        help='number of distinct users as a fraction of the events')
+    parser.add_argument('--dsn', default='host=127.0.0.1 dbname=studentdb user=student password=student',
+                        help='PostgreSQL or Redshift connection string of the sql engine')
+    parser.add_argument('--redshift', action='store_true',
+                        help='the dsn points at Redshift, shuffle bytes are read from svl_query_summary')
+    parser.add_argument('--shuffle-partitions', type=int, default=8)
+    parser.add_argument('--output', help='write the results to this json file')
+    args = parser.parse_args()
+
+    engines = args.engine or ['sql', 'spark']
+    results = []
+    if 'sql' in engines:
+        results += run_sql(args.dsn, args.sizes, args.users_per_event, args.redshift)
+    if 'spark' in engines:
+        results += run_spark(args.sizes, args.users_per_event, args.shuffle_partitions)
+
+    print('{:<6} {:<10} {:>10} {:>8} {:>8} {:>9} {:>14}'.format(
+        'engine', 'form', 'events', 'users', 'rows', 'seconds', 'shuffle_bytes'))
+    for r in results:
+        print('{engine:<6} {form:<10} {events:>10} {users:>8} {rows:>8} {seconds:>9.3f} {shuffle:>14}'.format(
+            shuffle='n/a' if r['shuffle_bytes'] is None else r['shuffle_bytes'], **r))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,63 @@
+import argparse
+import glob
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))),
+                                'project-1-Data-Modeling-with-PostgreSQL'))
+from batch_reader import read_json_batch, read_log_batch, LOG_DTYPES
+
+
+# the two ways project-1 process_log_file reads a log file, every column as read_json_batch parses it filtered
+# to NextSong afterwards, and read_log_batch that keeps the NextSong records and the used columns only
+
+
+def object_frame(filepath):
+    df = read_json_batch(filepath, LOG_DTYPES)
+    return df.loc[df['page'] == 'NextSong']
+
+
+def compact_frame(filepath):
+    return read_log_batch(filepath)
+
+
+def measure(read, filepath):
+    """Read a file, return the rows, seconds, peak traced bytes while reading and bytes of the frame kept"""
+    tracemalloc.start()
+    start = time.perf_counter()
+    df = read(filepath)
+    seconds = time.perf_counter() - start
+    peak = tracemalloc.get_traced_memory()[1]
+    tracemalloc.stop()
+    return {'rows': len(df), 'seconds': seconds, 'peak_bytes': peak,
+            'frame_bytes': int(df.memory_usage(index=True, deep=True).sum())}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the memory of the object and compact log dataframes per file')
+    parser.add_argument('--data', default='data/log_data', help='directory of the log data json files')
+    parser.add_argument('--output', help='write the results to this json file')
+    args = parser.parse_args()
+
+    files = sorted(glob.glob(os.path.join(args.data, '**', '*.json'), recursive=True))
+    print('{:<28} {:>8} {:>14} {:>14} {:>14} {:>14} {:>9} {:>9}'.format(
+        'file', 'rows', 'peak MB before', 'peak MB after', 'frame MB before', 'frame MB after', 's before', 's after'))
+    results = []
+    for filepath in files:
+        before = measure(object_frame, filepath)
+        after = measure(compact_frame, filepath)
+        results.append({'file': filepath, 'bytes': os.path.getsize(filepath), 'before': before, 'after': after})
+        print('{:<28} {:>8} {:>14.1f} {:>14.1f} {:>14.1f} {:>14.1f} {:>9.2f} {:>9.2f}'.format(
+            os.path.basename(filepath), after['rows'], before['peak_bytes'] / 2 ** 20, after['peak_bytes'] / 2 ** 20,
+            before['frame_bytes'] / 2 ** 20, after['frame_bytes'] / 2 ** 20, before['seconds'], after['seconds']))
+
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=2)
+
+
+if __name__ == "__main__":
+    main()
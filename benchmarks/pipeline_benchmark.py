@@ -0,0 +1,233 @@
+import argparse
+import configparser
+import json
+import multiprocessing
+import os
+import queue
+import resource
+import shutil
+import sys
+import time
+from datetime import datetime
+
+from sparkify_data import generate, read_manifest
+
+try:
+    import psutil
+except ImportError:
+    psutil = None
+
+
+# runs the pipelines of the projects on a synthetic data set of sparkify_data.py in local mode and records the
+# wall time, rows/sec and peak RSS of every stage, every stage runs in its own process so the peak RSS and the
+# imports of one stage, like the etl.py of project-1 and project-4, do not leak into the next
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECTS = {
+    'p1': os.path.join(ROOT, 'project-1-Data-Modeling-with-PostgreSQL'),
+    'p2': os.path.join(ROOT, 'project-2-Data-Modeling-with-Apache-Cassandra'),
+    'p4': os.path.join(ROOT, 'project-4-Data-Lake-with-Apache-Spark'),
+}
+STAGES = ['p1_etl', 'cassandra_loader', 'p4_process_song_data', 'p4_process_log_data']
+
+
+def run_p1_etl(options, manifest):
+    """Recreate sparkifydb and run project-1 etl.main in the data set directory, it reads data/song_data and
+    data/log_data from there"""
+    import create_tables
+    import etl
+    os.chdir(options['data'])
+    sys.argv = ['create_tables.py']
+    create_tables.main()
+    sys.argv = ['etl.py', '--mode', options['p1_mode']]
+    start = time.perf_counter()
+    etl.main()
+    return time.perf_counter() - start, manifest['songs'] + manifest['events'], {'mode': options['p1_mode']}
+
+
+def run_cassandra_loader(options, manifest):
+    """Recreate the Cassandra tables and load the event data csv files with the concurrent loader"""
+    from cassandra_loader import load_tables
+    from create_tables import connect, drop_tables, create_tables
+    from event_reader import event_files
+    cluster, session = connect(options['hosts'], options['port'])
+    drop_tables(session)
+    create_tables(session, options['buckets'])
+    start = time.perf_counter()
+    stats = load_tables(session, event_files(os.path.join(options['data'], 'event_data')), options['concurrency'])
+    seconds = time.perf_counter() - start
+    cluster.shutdown()
+    return seconds, stats['events'], stats
+
+
+def spark_session(options):
+    """Spark session of project-4 from the given dl.cfg, a local session without extra packages otherwise"""
+    from etl import create_spark_session, load_config
+    if options['spark_config']:
+        return create_spark_session(load_config(options['spark_config']), options['spark_profile'])
+    config = configparser.ConfigParser()
+    config['SPARK'] = {'MASTER': 'local[*]', 'PACKAGES': ''}
+    return create_spark_session(config)
+
+
+def run_p4_process_song_data(options, manifest):
+    """Write the songs and artists tables of project-4 to a fresh output directory"""
+    from etl import process_song_data
+    shutil.rmtree(options['lake'], ignore_errors=True)
+    spark = spark_session(options)
+    start = time.perf_counter()
+    process_song_data(spark, 'file://' + os.path.join(options['data'], 'data') + '/', 'file://' + options['lake'] + '/')
+    seconds = time.perf_counter() - start
+    spark.stop()
+    return seconds, manifest['songs'], {}
+
+
+def run_p4_process_log_data(options, manifest):
+    """Write the log tables of project-4, the songs are read back from the tables of the song stage"""
+    from etl import process_log_data
+    spark = spark_session(options)
+    start = time.perf_counter()
+    join_stats = process_log_data(spark, 'file://' + os.path.join(options['data'], 'data') + '/',
+                                  'file://' + options['lake'] + '/')
+    seconds = time.perf_counter() - start
+    spark.stop()
+    return seconds, manifest['events'], join_stats or {}
+
+
+stage_runners = {
+    'p1_etl': ('p1', run_p1_etl),
+    'cassandra_loader': ('p2', run_cassandra_loader),
+    'p4_process_song_data': ('p4', run_p4_process_song_data),
+    'p4_process_log_data': ('p4', run_p4_process_log_data),
+}
+
+
+def run_stage(stage, options, manifest, results):
+    """Run a stage in this process and put its seconds, rows and own peak RSS in results"""
+    project, runner = stage_runners[stage]
+    sys.path.insert(0, PROJECTS[project])
+    sys.path.insert(0, os.path.join(ROOT, 'common'))
+    os.chdir(PROJECTS[project])
+    try:
+        seconds, rows, detail = runner(options, manifest)
+        result = {'seconds': seconds, 'rows': rows, 'detail': detail}
+    except Exception as e:
+        result = {'error': '{}: {}'.format(type(e).__name__, e)}
+    # ru_maxrss is in kilobytes on linux, the children are the worker processes that already exited
+    result['process_peak_rss_bytes'] = max(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+                                           resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss) * 1024
+    results.put(result)
+
+
+def tree_rss(process):
+    """RSS of a process and all its descendants, the worker processes and the Spark JVM of a stage"""
+    total = 0
+    for p in [process] + process.children(recursive=True):
+        try:
+            total += p.memory_info().rss
+        except psutil.Error:
+            pass
+    return total
+
+
+def benchmark_stage(stage, options, manifest, sample_interval=0.1):
+    """Run a stage in a fresh process, sampling the RSS of its process tree while it runs"""
+    context = multiprocessing.get_context('spawn')
+    results = context.Queue()
+    child = context.Process(target=run_stage, args=(stage, options, manifest, results))
+    start = time.perf_counter()
+    child.start()
+    peak = 0
+    if psutil is not None:
+        process = psutil.Process(child.pid)
+        while child.is_alive():
+            try:
+                peak = max(peak, tree_rss(process))
+            except psutil.Error:
+                break
+            child.join(sample_interval)
+    try:
+        result = results.get(timeout=10)
+    except queue.Empty:
+        result = {'error': 'exit code {}'.format(child.exitcode)}
+    child.join()
+    wall_seconds = time.perf_counter() - start
+
+    result.update({'stage': stage, 'events': manifest['events'], 'wall_seconds': wall_seconds,
+                   'peak_rss_bytes': max(peak, result.pop('process_peak_rss_bytes', 0))})
+    if 'seconds' in result:
+        result['rows_per_sec'] = result['rows'] / result['seconds'] if result['seconds'] else 0.0
+    return result
+
+
+def previous_run(runs, manifest):
+    """Latest run of the results file on a data set generated with the same parameters"""
+    keys = ('events', 'songs', 'users', 'seed', 'skew')
+    for run in reversed(runs):
+        if all(run['data'].get(k) == manifest.get(k) for k in keys):
+            return run
+    return None
+
+
+def report(run, previous):
+    """Print the stages of a run and the change of their rows/sec since the previous run"""
+    before = {r['stage']: r for r in previous['stages']} if previous else {}
+    print('{:<22} {:>10} {:>10} {:>12} {:>10} {:>10}'.format(
+        'stage', 'rows', 'seconds', 'rows/sec', 'peak MB', 'vs last'))
+    for r in run['stages']:
+        if 'error' in r:
+            print('{:<22} failed: {}'.format(r['stage'], r['error']))
+            continue
+        last = before.get(r['stage'], {}).get('rows_per_sec')
+        change = '{:+.1%}'.format(r['rows_per_sec'] / last - 1) if last else ''
+        print('{:<22} {:>10} {:>10.2f} {:>12.0f} {:>10.1f} {:>10}'.format(
+            r['stage'], r['rows'], r['seconds'], r['rows_per_sec'], r['peak_rss_bytes'] / 2 ** 20, change))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the pipelines on a synthetic Sparkify data set')
+    parser.add_argument('--data', default='sparkify_data',
+                        help='directory of the data set, generated with --events, --songs, --users and --seed '
+                             'when it has none')
+    parser.add_argument('--events', type=int, default=10000)
+    parser.add_argument('--songs', type=int, default=10000)
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--stage', choices=STAGES, action='append', help='stages to run, all when not given')
+    parser.add_argument('--output', default='pipeline_benchmark.json',
+                        help='json results file, every run is appended to it')
+    parser.add_argument('--p1-mode', choices=['row', 'bulk', 'parallel'], default='bulk',
+                        help='--mode of the project-1 etl')
+    parser.add_argument('--hosts', nargs='+', default=['127.0.0.1'], help='contact points of the Cassandra cluster')
+    parser.add_argument('--port', type=int, default=9042)
+    parser.add_argument('--buckets', type=int, default=0, help='bucket count of song_library, 0 for no buckets')
+    parser.add_argument('--concurrency', type=int, default=128, help='most Cassandra writes in flight at a time')
+    parser.add_argument('--spark-config', help='dl.cfg of project-4, a local session when not given')
+    parser.add_argument('--spark-profile', default='SPARK')
+    parser.add_argument('--lake', help='output directory of the project-4 tables, <data>/lake by default')
+    args = parser.parse_args()
+
+    data = os.path.abspath(args.data)
+    manifest = read_manifest(data)
+    if manifest is None:
+        manifest = generate(data, args.events, args.songs, num_users=args.users, seed=args.seed)
+        print('generated {events} events in {seconds:.1f}s'.format(**manifest))
+
+    options = {'data': data, 'p1_mode': args.p1_mode, 'hosts': args.hosts, 'port': args.port,
+               'buckets': args.buckets, 'concurrency': args.concurrency, 'spark_config': args.spark_config,
+               'spark_profile': args.spark_profile, 'lake': os.path.abspath(args.lake or os.path.join(data, 'lake'))}
+    run = {'started': datetime.now().isoformat(timespec='seconds'), 'data': manifest,
+           'stages': [benchmark_stage(stage, options, manifest) for stage in args.stage or STAGES]}
+
+    runs = []
+    if os.path.exists(args.output):
+        with open(args.output) as f:
+            runs = json.load(f)
+    report(run, previous_run(runs, manifest))
+    runs.append(run)
+    with open(args.output, 'w') as f:
+        json.dump(runs, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,92 @@
+import argparse
+import configparser
+import json
+import os
+import statistics
+import sys
+import time
+
+import psycopg2
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+PROJECTS = {
+    'p1': os.path.join(ROOT, 'project-1-Data-Modeling-with-PostgreSQL'),
+    'p3': os.path.join(ROOT, 'project-3-Data-Warehouse-with-AWS-Redshift'),
+}
+
+
+# times the dashboard questions of common/dashboard.py on the rollup tables against the same questions on the raw
+# songplays table of a loaded project-1 or project-3 database, and checks both return the same rows
+
+
+def connect(args):
+    """Connection to sparkifydb for project-1, to the cluster or PostgreSQL stand-in of dwh.cfg for project-3"""
+    if args.project == 'p1':
+        from dashboard_queries import DSN
+        return psycopg2.connect(DSN)
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+    section = 'CLUSTER' if args.target == 'redshift' else 'POSTGRES'
+    return psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config[section].values()))
+
+
+def time_question(queries, question, repeat, **params):
+    """Ask a question repeat times, return its rows, the median milliseconds and the table the answer came from"""
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rows = getattr(queries, question)(**params)
+        timings.append((time.perf_counter() - start) * 1000)
+    return rows, statistics.median(timings), queries.last_source
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Compare the dashboard queries on the rollup tables and on songplays')
+    parser.add_argument('--project', choices=sorted(PROJECTS), default='p1')
+    parser.add_argument('--config', default='.', help='directory of the dwh.cfg of project-3')
+    parser.add_argument('--target', choices=['redshift', 'postgres'], default='redshift',
+                        help='postgres queries the project-3 PostgreSQL stand-in in [POSTGRES]')
+    parser.add_argument('--repeat', type=int, default=5, help='times every question is asked, the median is reported')
+    parser.add_argument('--limit', type=int, default=10, help='number of top songs and artists')
+    parser.add_argument('--output', help='write the results to this json file')
+    args = parser.parse_args()
+
+    # sql_queries of project-3 reads dwh.cfg from the working directory when it is imported
+    os.chdir(os.path.abspath(args.config))
+    sys.path.insert(0, PROJECTS[args.project])
+    sys.path.insert(0, os.path.join(ROOT, 'common'))
+    import sql_queries
+    from dashboard import DashboardQueries, questions, question_params
+
+    conn = connect(args)
+    cur = conn.cursor()
+    rollups, raw = DashboardQueries(cur, sql_queries), DashboardQueries(cur, sql_queries, use_rollups=False)
+    full_range = raw.full_range()
+    if full_range is None:
+        print('no songplays loaded')
+        return
+    start, end = full_range
+    print('{} songplays from {:%Y-%m-%d} to {:%Y-%m-%d}, median of {} runs'.format(args.project, start, end, args.repeat))
+
+    print('{:<16} {:>8} {:>10} {:>12} {:>10} {:>8} {:>6}'.format(
+        'question', 'rows', 'raw ms', 'rollup ms', 'speedup', 'source', 'same'))
+    results = []
+    for question, _, _ in questions:
+        params = question_params(question, args.limit)
+        raw_rows, raw_ms, _ = time_question(raw, question, args.repeat, start=start, end=end, **params)
+        rollup_rows, rollup_ms, source = time_question(rollups, question, args.repeat, start=start, end=end, **params)
+        result = {'question': question, 'rows': len(raw_rows), 'raw_ms': raw_ms, 'rollup_ms': rollup_ms,
+                  'speedup': raw_ms / rollup_ms if rollup_ms else 0.0, 'source': source,
+                  'same': [tuple(r) for r in raw_rows] == [tuple(r) for r in rollup_rows]}
+        results.append(result)
+        print('{question:<16} {rows:>8} {raw_ms:>10.2f} {rollup_ms:>12.2f} {speedup:>9.1f}x {source:>8} {same!s:>6}'.format(**result))
+
+    conn.close()
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump({'project': args.project, 'start': start, 'end': end, 'repeat': args.repeat,
+                       'questions': results}, f, indent=2, default=str)
+
+
+if __name__ == "__main__":
+    main()
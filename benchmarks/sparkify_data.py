@@ -0,0 +1,276 @@
+import argparse
+import bisect
+import csv
+import itertools
+import json
+import os
+import random
+import time
+from datetime import date, datetime, timedelta, timezone
+
+
+# a seeded synthetic Sparkify data set in the layouts the projects read:
+#   data/song_data/A/B/C/TR....json          song data of project-1 and project-4, json lines
+#   data/log_data/2018/11/2018-11-01-events.json   log data of project-1 and project-4, json lines
+#   event_data/2018-11-01-events.csv         event data of project-2
+# and sparkify_data.json, the manifest with the parameters and counts of the data set
+
+FIRST_DAY = date(2018, 11, 1)
+DAY_MS = 24 * 3600 * 1000
+
+# columns of the event data csv files, the log data columns without userAgent
+EVENT_COLUMNS = ['artist', 'auth', 'firstName', 'gender', 'itemInSession', 'lastName', 'length', 'level',
+                 'location', 'method', 'page', 'registration', 'sessionId', 'song', 'status', 'ts', 'userId']
+
+# pages of the events that are not song plays and how often they are visited relative to each other
+OTHER_PAGES = [('Home', 40), ('Logout', 10), ('Settings', 5), ('Help', 5), ('About', 2), ('Upgrade', 3),
+               ('Downgrade', 2), ('Add to Playlist', 15), ('Thumbs Up', 15), ('Thumbs Down', 3)]
+
+WORDS = ['love', 'night', 'heart', 'fire', 'dream', 'city', 'blue', 'river', 'light', 'home', 'rain', 'road',
+         'summer', 'gold', 'shadow', 'ocean', 'wild', 'dance', 'forever', 'young', 'broken', 'star', 'moon',
+         'silver', 'storm', 'highway', 'paradise', 'echo', 'sugar', 'thunder', 'midnight', 'electric']
+FIRST_NAMES = ['Lily', 'Jacob', 'Kate', 'Chloe', 'Tegan', 'Aleena', 'Ryan', 'Mohammad', 'Jayden', 'Sara',
+               'Kevin', 'Emily', 'Noah', 'Ava', 'Lucas', 'Mia', 'Ethan', 'Zoe', 'Liam', 'Isla']
+LAST_NAMES = ['Koch', 'Klein', 'Harrell', 'Cuevas', 'Levine', 'Kirby', 'Smith', 'Rodriguez', 'Bell', 'Franklin',
+              'Johnson', 'Lee', 'Nguyen', 'Garcia', 'Miller', 'Davis', 'Walker', 'Young', 'King', 'Scott']
+LOCATIONS = ['San Jose-Sunnyvale-Santa Clara, CA', 'Chicago-Naperville-Elgin, IL-IN-WI',
+             'New York-Newark-Jersey City, NY-NJ-PA', 'Atlanta-Sandy Springs-Roswell, GA',
+             'Lansing-East Lansing, MI', 'Portland-South Portland, ME', 'Houston-The Woodlands-Sugar Land, TX']
+USER_AGENTS = ['"Mozilla/5.0 (Windows NT 6.1; WOW64) AppleWebKit/537.36 (KHTML, like Gecko) '
+               'Chrome/36.0.1985.143 Safari/537.36"',
+               '"Mozilla/5.0 (Macintosh; Intel Mac OS X 10_9_4) AppleWebKit/537.36 (KHTML, like Gecko) '
+               'Chrome/36.0.1985.125 Safari/537.36"',
+               'Mozilla/5.0 (Windows NT 6.1; WOW64; rv:31.0) Gecko/20100101 Firefox/31.0']
+
+ID_CHARS = 'ABCDEFGHIJKLMNOPQRSTUVWXYZ0123456789'
+
+
+def random_id(rng, prefix):
+    """Id like the ones of the million song data set, TRAAAAW128F429D538"""
+    return prefix + ''.join(rng.choice(ID_CHARS[:26]) for _ in range(3)) + \
+        ''.join(rng.choice(ID_CHARS) for _ in range(13))
+
+
+def random_name(rng, words):
+    return ' '.join(rng.choice(WORDS).capitalize() for _ in range(words))
+
+
+def synthetic_songs(num_songs, num_artists, seed=0):
+    """Generate the song records, several songs per artist like the million song data set"""
+    rng = random.Random(seed)
+    artists = []
+    for _ in range(num_artists):
+        located = rng.random() < 0.4
+        artists.append({'artist_id': random_id(rng, 'AR'),
+                        'artist_latitude': round(rng.uniform(-60, 70), 5) if located else None,
+                        'artist_longitude': round(rng.uniform(-150, 150), 5) if located else None,
+                        'artist_location': rng.choice(LOCATIONS) if located else '',
+                        'artist_name': random_name(rng, rng.randint(1, 3))})
+    songs = []
+    for _ in range(num_songs):
+        song = {'num_songs': 1, 'track_id': random_id(rng, 'TR')}
+        song.update(rng.choice(artists))
+        song.update({'song_id': random_id(rng, 'SO'), 'title': random_name(rng, rng.randint(1, 5)),
+                     'duration': round(rng.uniform(60, 600), 5),
+                     'year': rng.choice([0, 0, 0] + list(range(1960, 2019)))})
+        songs.append(song)
+    return songs
+
+
+def popularity(num_songs, skew):
+    """Cumulative Zipf weights of the songs ranked by popularity, the song of rank r is played 1/r**skew as often
+    as the most popular one"""
+    return list(itertools.accumulate(1 / rank ** skew for rank in range(1, num_songs + 1)))
+
+
+class SyntheticUsers:
+    """Users with their level and current session, a session ends after about session_length events"""
+
+    def __init__(self, rng, num_users, session_length):
+        self.rng = rng
+        self.session_end = 1 / session_length
+        self.users = [{'userId': str(user_id), 'firstName': rng.choice(FIRST_NAMES),
+                       'lastName': rng.choice(LAST_NAMES), 'gender': rng.choice('MF'),
+                       'level': 'paid' if rng.random() < 0.3 else 'free', 'location': rng.choice(LOCATIONS),
+                       'userAgent': rng.choice(USER_AGENTS),
+                       'registration': float(1540000000000 + rng.randrange(30 * DAY_MS)),
+                       'sessionId': None, 'itemInSession': 0}
+                      for user_id in range(1, num_users + 1)]
+        self.next_session = 1
+
+    def next_event(self):
+        """Pick the user of the next event and move it to its next item, or a new session"""
+        user = self.rng.choice(self.users)
+        if user['sessionId'] is None or self.rng.random() < self.session_end:
+            user['sessionId'] = self.next_session
+            user['itemInSession'] = 0
+            self.next_session += 1
+            # levels change now and then between sessions
+            if self.rng.random() < 0.02:
+                user['level'] = 'free' if user['level'] == 'paid' else 'paid'
+        else:
+            user['itemInSession'] += 1
+        return user
+
+
+def synthetic_events(songs, num_events, num_users, days, skew=1.0, unknown_songs=0.2, song_play_rate=0.8,
+                     session_length=20, seed=0):
+    """Yield (day, log event) in time order, num_events spread evenly over days.
+
+    The played songs follow a Zipf popularity with skew, unknown_songs of the song plays are songs that are not
+    in the song data, like most of the plays of the Sparkify logs.
+    """
+    rng = random.Random(seed + 1)
+    users = SyntheticUsers(rng, num_users, session_length)
+    cum_weights = popularity(len(songs), skew)
+    total_weight = cum_weights[-1]
+    # the popular songs are not the first ones generated
+    ranked = list(range(len(songs)))
+    rng.shuffle(ranked)
+    pages, page_weights = zip(*OTHER_PAGES)
+    step_ms = days * DAY_MS / max(1, num_events)
+    first_ms = int(datetime(FIRST_DAY.year, FIRST_DAY.month, FIRST_DAY.day, tzinfo=timezone.utc).timestamp() * 1000)
+
+    for n in range(num_events):
+        offset = int((n + rng.random()) * step_ms)
+        day = FIRST_DAY + timedelta(days=offset // DAY_MS)
+        ts = first_ms + offset
+        user = users.next_event()
+        event = {'artist': None, 'auth': 'Logged In', 'firstName': user['firstName'], 'gender': user['gender'],
+                 'itemInSession': user['itemInSession'], 'lastName': user['lastName'], 'length': None,
+                 'level': user['level'], 'location': user['location'], 'method': 'GET', 'page': None,
+                 'registration': user['registration'], 'sessionId': user['sessionId'], 'song': None,
+                 'status': 200, 'ts': ts, 'userAgent': user['userAgent'], 'userId': user['userId']}
+        if rng.random() < song_play_rate:
+            event['page'] = 'NextSong'
+            event['method'] = 'PUT'
+            if rng.random() < unknown_songs:
+                event['artist'] = random_name(rng, rng.randint(1, 3))
+                event['song'] = random_name(rng, rng.randint(1, 5))
+                event['length'] = round(rng.uniform(60, 600), 5)
+            else:
+                song = songs[ranked[bisect.bisect(cum_weights, rng.random() * total_weight)]]
+                event['artist'] = song['artist_name']
+                event['song'] = song['title']
+                event['length'] = song['duration']
+        else:
+            event['page'] = rng.choices(pages, page_weights)[0]
+            if event['page'] == 'Logout':
+                user['sessionId'] = None
+        yield day, event
+
+
+def write_song_data(output, songs, songs_per_file=1):
+    """Write the song data, songs_per_file songs per json lines file named after the track id of its first song"""
+    files = 0
+    for i in range(0, len(songs), songs_per_file):
+        batch = songs[i:i + songs_per_file]
+        track_id = batch[0]['track_id']
+        directory = os.path.join(output, 'data', 'song_data', track_id[2], track_id[3], track_id[4])
+        os.makedirs(directory, exist_ok=True)
+        with open(os.path.join(directory, track_id + '.json'), 'w', encoding='utf8') as f:
+            for song in batch:
+                f.write(json.dumps({k: v for k, v in song.items() if k != 'track_id'}) + '\n')
+        files += 1
+    return files
+
+
+def write_event_files(output, event_iter, log_data=True, event_data=True):
+    """Write the events of every day to its log data json lines file and its event data csv file.
+
+    Only the files of the current day are open, the events are never all kept in memory.
+    Returns the number of events and song plays.
+    """
+    counts = {'events': 0, 'song_plays': 0, 'days': 0}
+    current_day, log_file, csv_file, writer = None, None, None, None
+    for day, event in event_iter:
+        if day != current_day:
+            for f in (log_file, csv_file):
+                if f is not None:
+                    f.close()
+            current_day = day
+            counts['days'] += 1
+            name = '{}-events'.format(day.isoformat())
+            if log_data:
+                directory = os.path.join(output, 'data', 'log_data', str(day.year), '{:02d}'.format(day.month))
+                os.makedirs(directory, exist_ok=True)
+                log_file = open(os.path.join(directory, name + '.json'), 'w', encoding='utf8')
+            if event_data:
+                directory = os.path.join(output, 'event_data')
+                os.makedirs(directory, exist_ok=True)
+                csv_file = open(os.path.join(directory, name + '.csv'), 'w', encoding='utf8', newline='')
+                writer = csv.writer(csv_file)
+                writer.writerow(EVENT_COLUMNS)
+        if log_data:
+            log_file.write(json.dumps(event) + '\n')
+        if event_data:
+            writer.writerow(['' if event[c] is None else event[c] for c in EVENT_COLUMNS])
+        counts['events'] += 1
+        counts['song_plays'] += event['page'] == 'NextSong'
+    for f in (log_file, csv_file):
+        if f is not None:
+            f.close()
+    return counts
+
+
+def directory_bytes(path):
+    return sum(os.path.getsize(os.path.join(root, name)) for root, dirs, files in os.walk(path) for name in files)
+
+
+def generate(output, num_events, num_songs=10000, num_artists=None, num_users=1000, days=30, skew=1.0,
+             unknown_songs=0.2, songs_per_file=1, log_data=True, event_data=True, seed=0):
+    """Write a synthetic data set to output and its manifest to output/sparkify_data.json, return the manifest"""
+    start = time.perf_counter()
+    songs = synthetic_songs(num_songs, num_artists or max(1, num_songs // 4), seed)
+    song_files = write_song_data(output, songs, songs_per_file)
+    counts = write_event_files(output, synthetic_events(songs, num_events, num_users, days, skew, unknown_songs,
+                                                        seed=seed), log_data, event_data)
+
+    manifest = {'seed': seed, 'songs': num_songs, 'song_files': song_files, 'users': num_users, 'skew': skew,
+                'unknown_songs': unknown_songs, 'seconds': time.perf_counter() - start}
+    manifest.update(counts)
+    for name, path in [('song_data', os.path.join(output, 'data', 'song_data')),
+                       ('log_data', os.path.join(output, 'data', 'log_data')),
+                       ('event_data', os.path.join(output, 'event_data'))]:
+        manifest[name + '_bytes'] = directory_bytes(path) if os.path.isdir(path) else 0
+    with open(os.path.join(output, 'sparkify_data.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+    return manifest
+
+
+def read_manifest(output):
+    """Manifest of the data set in output, None when there is none"""
+    path = os.path.join(output, 'sparkify_data.json')
+    if not os.path.exists(path):
+        return None
+    with open(path) as f:
+        return json.load(f)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate a synthetic Sparkify data set')
+    parser.add_argument('--output', default='sparkify_data', help='directory of the data set')
+    parser.add_argument('--events', type=int, default=10000, help='number of log events')
+    parser.add_argument('--songs', type=int, default=10000, help='number of songs of the song data')
+    parser.add_argument('--users', type=int, default=1000)
+    parser.add_argument('--days', type=int, default=30, help='days of log data from 2018-11-01 on')
+    parser.add_argument('--skew', type=float, default=1.0,
+                        help='Zipf exponent of the song popularity, 0 plays every song equally often')
+    parser.add_argument('--unknown-songs', type=float, default=0.2,
+                        help='fraction of the song plays of songs that are not in the song data')
+    parser.add_argument('--songs-per-file', type=int, default=1,
+                        help='songs of every song data file, the Sparkify data has one')
+    parser.add_argument('--no-log-data', action='store_true', help='only write the event data csv files')
+    parser.add_argument('--no-event-data', action='store_true', help='only write the log data json files')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    manifest = generate(args.output, args.events, args.songs, None, args.users, args.days, args.skew,
+                        args.unknown_songs, args.songs_per_file, not args.no_log_data, not args.no_event_data,
+                        args.seed)
+    print('{events} events, {song_plays} song plays over {days} days, {songs} songs in {song_files} files '
+          'in {seconds:.1f}s'.format(**manifest))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import argparse
+import time
+from datetime import datetime, timedelta
+
+# the dashboard questions of project-1 and project-3, the dashboard_queries.py of every project passes its own
+# sql_queries module
+
+# the questions of the dashboards: method of DashboardQueries, title, and whether it takes the number of top rows
+questions = [('plays_per_hour', 'plays per hour', False),
+             ('top_songs', 'top songs', True),
+             ('top_artists', 'top artists', True),
+             ('level_users', 'free and paid users by day', False)]
+
+
+def aligned(value, unit):
+    """True when a datetime is on the boundary of an hour or a day, the grain of the rollup tables"""
+    if unit == 'hour':
+        return value == value.replace(minute=0, second=0, microsecond=0)
+    return value == value.replace(hour=0, minute=0, second=0, microsecond=0)
+
+
+def question_params(question, limit):
+    """Keyword arguments of a question besides its range, the number of top rows of top_songs and top_artists"""
+    takes_limit = next(takes for name, _, takes in questions if name == question)
+    return {'limit': limit} if takes_limit else {}
+
+
+class DashboardQueries:
+    """The questions of the dashboards, answered from the rollup tables when they can answer them.
+
+    sql is the sql_queries module of the project, with dashboard_queries (the rollup and raw query of every question),
+    rollups_current_select and songplays_range_select. A question falls back to its query on the raw tables when the
+    rollups are behind the songplays or when the range does not start and end on the grain of its rollup table, an hour
+    for plays_per_hour and a day for the others. Ranges are [start, end). The table the last answer came from is kept
+    in last_source.
+    """
+
+    # grain of the rollup table of every question
+    grains = {'plays_per_hour': 'hour', 'top_songs': 'day', 'top_artists': 'day', 'level_users': 'day'}
+
+    def __init__(self, cur, sql, use_rollups=True):
+        self.cur = cur
+        self.sql = sql
+        self.use_rollups = use_rollups
+        self.last_source = None
+
+    def rollups_current(self):
+        """True when the rollup watermark has caught up with the songplays"""
+        self.cur.execute(self.sql.rollups_current_select)
+        return self.cur.fetchone()[0]
+
+    def full_range(self):
+        """The days of the first and last songplay as a [start, end) range, None when there are no songplays"""
+        self.cur.execute(self.sql.songplays_range_select)
+        first, last = self.cur.fetchone()
+        if first is None:
+            return None
+        return datetime.combine(first.date(), datetime.min.time()), datetime.combine(last.date() + timedelta(days=1), datetime.min.time())
+
+    def _answer(self, question, start, end, **params):
+        rollup_query, raw_query = self.sql.dashboard_queries[question]
+        grain = self.grains[question]
+        use_rollup = self.use_rollups and aligned(start, grain) and aligned(end, grain) and self.rollups_current()
+        self.last_source = 'rollup' if use_rollup else 'raw'
+        self.cur.execute(rollup_query if use_rollup else raw_query, dict(params, start=start, end=end))
+        return self.cur.fetchall()
+
+    def plays_per_hour(self, start, end):
+        """(hour, plays) of every hour with songplays"""
+        return self._answer('plays_per_hour', start, end)
+
+    def top_songs(self, start, end, limit=10):
+        """(song_id, title, plays) of the most played songs"""
+        return self._answer('top_songs', start, end, limit=limit)
+
+    def top_artists(self, start, end, limit=10):
+        """(artist_id, name, plays) of the most played artists"""
+        return self._answer('top_artists', start, end, limit=limit)
+
+    def level_users(self, start, end):
+        """(day, level, users) the free and paid users of every day"""
+        return self._answer('level_users', start, end)
+
+
+def argument_parser():
+    """Arguments of the dashboard_queries.py script of every project, a project adds its connection arguments"""
+    parser = argparse.ArgumentParser(description='Answer the dashboard questions from the rollup tables')
+    parser.add_argument('--start', type=datetime.fromisoformat, help='first day or hour, the first songplay by default')
+    parser.add_argument('--end', type=datetime.fromisoformat, help='end of the range, exclusive, the day after the last songplay by default')
+    parser.add_argument('--limit', type=int, default=5, help='number of top songs and artists')
+    parser.add_argument('--raw', action='store_true', help='always query the raw tables')
+    return parser
+
+
+def print_answers(cur, sql, args):
+    """Print the answer of every question over the range of args, with the table it came from and its time"""
+    queries = DashboardQueries(cur, sql, use_rollups=not args.raw)
+    full_range = queries.full_range()
+    if full_range is None:
+        print('no songplays loaded')
+        return
+    start, end = args.start or full_range[0], args.end or full_range[1]
+
+    for question, title, _ in questions:
+        begin = time.perf_counter()
+        rows = getattr(queries, question)(start, end, **question_params(question, args.limit))
+        print('{} from the {} tables in {:.1f}ms'.format(title, queries.last_source, (time.perf_counter() - begin) * 1000))
+        for row in rows:
+            print(*row)
@@ -0,0 +1,110 @@
+import json
+import os
+import re
+import sys
+import time
+from collections import defaultdict
+from contextlib import contextmanager
+
+# the one module used by the etl of project-1, project-3 and project-4, imported from the PYTHONPATH
+
+# command and table of a sql statement, the name of its stage
+STATEMENT_PATTERN = re.compile(r'^\s*(copy|insert\s+into|delete\s+from|update|truncate(?:\s+table)?|'
+                               r'create\s+(?:temp\s+)?table(?:\s+if\s+not\s+exists)?|'
+                               r'drop\s+table(?:\s+if\s+exists)?|select)\s+(\w+)', re.IGNORECASE)
+
+
+def statement_name(query):
+    """Stage name of a sql statement, its command and table like 'insert songplays'"""
+    match = STATEMENT_PATTERN.search(query)
+    if match is None:
+        return ' '.join(query.split()[:2]).lower()
+    return '{} {}'.format(match.group(1).split()[0].lower(), match.group(2).lower())
+
+
+def prometheus_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+class Metrics:
+    """Timers and row and byte counters of the stages of a job.
+
+    Every stage is logged as one json line when it ends and added to the totals of its name, which can be
+    written to a Prometheus text file for the node exporter textfile collector.
+    """
+
+    def __init__(self, job='sparkify', log=None, prometheus_path=None):
+        self.configure(job, log, prometheus_path)
+
+    def configure(self, job, log=None, prometheus_path=None):
+        """Set the job name, the json log file, stderr when not given, and the Prometheus text file of the run"""
+        self.job = job
+        self.log_file = open(log, 'a', encoding='utf8') if isinstance(log, str) else log
+        self.prometheus_path = prometheus_path
+        self.totals = defaultdict(lambda: defaultdict(float))
+
+    def log(self, event, **fields):
+        """Write one structured json log line"""
+        record = {'time': time.strftime('%Y-%m-%dT%H:%M:%S'), 'job': self.job, 'event': event}
+        record.update(fields)
+        print(json.dumps(record, default=str), file=self.log_file or sys.stderr, flush=True)
+
+    @contextmanager
+    def stage(self, name, **labels):
+        """Time a stage, the counts like rows_read, rows_written, bytes_read and bytes_written the block sets
+        in the yielded dict are logged with it and added to its totals"""
+        counts = {}
+        start = time.perf_counter()
+        status = 'ok'
+        try:
+            yield counts
+        except BaseException:
+            status = 'error'
+            raise
+        finally:
+            seconds = time.perf_counter() - start
+            totals = self.totals[name]
+            totals['runs'] += 1
+            totals['seconds'] += seconds
+            totals['errors'] += status == 'error'
+            for key, value in counts.items():
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    totals[key] += value
+            self.log('stage', stage=name, status=status, seconds=round(seconds, 6), **labels, **counts)
+
+    def execute(self, cur, query, params=None, conn=None, name=None):
+        """Execute a sql statement as a stage named after its command and table, committing conn in the stage
+        when given. The rows of the statement are counted as rows_written"""
+        with self.stage(name or statement_name(query)) as counts:
+            cur.execute(query, params)
+            if cur.rowcount is not None and cur.rowcount >= 0:
+                counts['rows_written'] = cur.rowcount
+            if conn is not None:
+                conn.commit()
+
+    def prometheus_text(self):
+        """Totals of every stage in the Prometheus text format"""
+        metrics = defaultdict(list)
+        for name, totals in sorted(self.totals.items()):
+            labels = 'job="{}",stage="{}"'.format(prometheus_label(self.job), prometheus_label(name))
+            for key, value in sorted(totals.items()):
+                metrics['sparkify_stage_{}_total'.format(re.sub(r'\W', '_', key))].append(
+                    '{{{}}} {}'.format(labels, repr(float(value))))
+        lines = []
+        for metric, samples in sorted(metrics.items()):
+            lines.append('# TYPE {} counter'.format(metric))
+            lines.extend(metric + sample for sample in samples)
+        return '\n'.join(lines) + '\n'
+
+    def write_prometheus(self, path=None):
+        """Write the totals to the Prometheus text file, replaced in one step so a scrape never reads half a file"""
+        path = path or self.prometheus_path
+        if not path:
+            return
+        with open(path + '.tmp', 'w') as f:
+            f.write(self.prometheus_text())
+        os.replace(path + '.tmp', path)
+
+
+# metrics of the running job, configured by the main of the etl
+metrics = Metrics()
@@ -0,0 +1,113 @@
+import json
+import pandas as pd
+
+# explicit column types of the song and log data files, numeric columns are parsed once per batch
+SONG_DTYPES = {
+    'num_songs': 'Int64',
+    'artist_id': object,
+    'artist_latitude': 'float64',
+    'artist_longitude': 'float64',
+    'artist_location': object,
+    'artist_name': object,
+    'song_id': object,
+    'title': object,
+    'duration': 'float64',
+    'year': 'Int64',
+}
+
+LOG_DTYPES = {
+    'artist': object,
+    'auth': object,
+    'firstName': object,
+    'gender': object,
+    'itemInSession': 'Int64',
+    'lastName': object,
+    'length': 'float64',
+    'level': object,
+    'location': object,
+    'method': object,
+    'page': object,
+    'registration': 'float64',
+    'sessionId': 'Int64',
+    'song': object,
+    'status': 'Int64',
+    'ts': 'Int64',
+    'userAgent': object,
+    # logged out events have an empty userId, it is parsed as NULL
+    'userId': 'Int64',
+}
+
+# columns of the NextSong log records the etl uses and their compact types, the repetitive strings are
+# categorical and page, auth, method, itemInSession, registration and status are not read at all
+SONGPLAY_LOG_DTYPES = {
+    'artist': object,
+    'firstName': 'category',
+    'gender': 'category',
+    'lastName': 'category',
+    'length': 'float64',
+    'level': 'category',
+    'location': 'category',
+    'sessionId': 'Int32',
+    'song': object,
+    'ts': 'Int64',
+    'userAgent': 'category',
+    'userId': 'Int32',
+}
+
+
+def read_json_batch(filepaths, dtypes):
+    """Read a list of json lines files into one dataframe with the columns and types given in dtypes"""
+    if isinstance(filepaths, str):
+        filepaths = [filepaths]
+
+    records = []
+    for filepath in filepaths:
+        with open(filepath, encoding='utf8') as f:
+            records.extend(json.loads(line) for line in f if line.strip())
+
+    df = pd.DataFrame.from_records(records, columns=list(dtypes))
+    for column, dtype in dtypes.items():
+        if dtype is not object:
+            df[column] = pd.to_numeric(df[column], errors='coerce').astype(dtype)
+    return df
+
+
+def null_records(df):
+    """Return the rows of df as tuples of python values with NaN and NA replaced by None, loaded as NULL in sql"""
+    df = df.astype(object)
+    return list(df.where(df.notnull(), None).itertuples(index=False, name=None))
+
+
+def read_log_batch(filepaths, dtypes=SONGPLAY_LOG_DTYPES):
+    """Read the NextSong records of a list of log json lines files into one dataframe with only the columns of dtypes.
+
+    Other pages are dropped before their line is parsed and every record is reduced to the values of dtypes right away,
+    so only one list per column is kept instead of a dict per record. The columns are then converted once to their
+    compact types, strings in categorical columns are stored once per distinct value.
+    """
+    if isinstance(filepaths, str):
+        filepaths = [filepaths]
+
+    values = {column: [] for column in dtypes}
+    for filepath in filepaths:
+        with open(filepath, encoding='utf8') as f:
+            for line in f:
+                # cheap test on the raw line, the page is checked again once it is parsed
+                if '"NextSong"' not in line:
+                    continue
+                record = json.loads(line)
+                if record.get('page') != 'NextSong':
+                    continue
+                for column, column_values in values.items():
+                    column_values.append(record.get(column))
+
+    columns = {}
+    for column, dtype in dtypes.items():
+        column_values = values.pop(column)
+        if dtype == 'category':
+            columns[column] = pd.Categorical(column_values)
+        elif dtype is object:
+            columns[column] = pd.array(column_values, dtype=object)
+        else:
+            columns[column] = pd.to_numeric(pd.Series(column_values, dtype=object), errors='coerce').astype(dtype).array
+    return pd.DataFrame(columns, copy=False)
@@ -1,5 +1,6 @@
+import argparse
 import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from sql_queries import create_table_queries, drop_table_queries, create_index_queries
 
 
 def create_database():
@@ -22,6 +23,22 @@ def create_database():
     return cur, conn
 
 
+def connect_database():
+    """Connect to the sparkify database, creating it if it does not exist yet, without dropping any data"""
+    conn = psycopg2.connect("host=127.0.0.1 dbname=studentdb user=student password=student")
+    conn.set_session(autocommit=True)
+    cur = conn.cursor()
+    cur.execute("SELECT 1 FROM pg_database WHERE datname = 'sparkifydb'")
+    if cur.fetchone() is None:
+        cur.execute("CREATE DATABASE sparkifydb WITH ENCODING 'utf8' TEMPLATE template0")
+    conn.close()
+
+    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    cur = conn.cursor()
+
+    return cur, conn
+
+
 def drop_tables(cur, conn):
     for query in drop_table_queries:
         cur.execute(query)
@@ -34,11 +51,29 @@ def create_tables(cur, conn):
         conn.commit()
 
 
+def create_indexes(cur, conn):
+    """Create the lookup and analytics indexes, the songplays indexes are created on every partition"""
+    for query in create_index_queries:
+        cur.execute(query)
+        conn.commit()
+
+
 def main():
-    cur, conn = create_database()
-    
-    drop_tables(cur, conn)
+    parser = argparse.ArgumentParser(description='Create the sparkifydb star schema')
+    parser.add_argument('--incremental', action='store_true',
+                        help='keep the existing database and only create the tables that are missing')
+    parser.add_argument('--defer-indexes', action='store_true',
+                        help='create the tables without their secondary indexes, etl.py --mode bulk builds them after the load')
+    args = parser.parse_args()
+
+    if args.incremental:
+        cur, conn = connect_database()
+    else:
+        cur, conn = create_database()
+        drop_tables(cur, conn)
     create_tables(cur, conn)
+    if not args.defer_indexes:
+        create_indexes(cur, conn)
 
     conn.close()
 
@@ -0,0 +1,17 @@
+import psycopg2
+import sql_queries
+from dashboard import argument_parser, print_answers
+
+DSN = "host=127.0.0.1 dbname=sparkifydb user=student password=student"
+
+
+def main():
+    args = argument_parser().parse_args()
+
+    conn = psycopg2.connect(DSN)
+    print_answers(conn.cursor(), sql_queries, args)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
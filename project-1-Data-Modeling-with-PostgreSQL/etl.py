@@ -1,63 +1,88 @@
 import os
+import io
 import glob
+import time
+import argparse
+import multiprocessing
 import psycopg2
+import psycopg2.pool
+import psycopg2.errors
 import pandas as pd
 import json
+from functools import partial
 from sql_queries import *
+from psycopg2.extras import execute_batch
+from batch_reader import read_json_batch, read_log_batch, null_records, SONG_DTYPES
+from song_index import SongIndex
+from manifest import pending_files, record_files
+from instrumentation import metrics
 
+DSN = "host=127.0.0.1 dbname=sparkifydb user=student password=student"
+
+# how often a batch is retried when concurrent workers deadlock on the same rows
+BATCH_RETRIES = 3
+
+# connection pool and song index of a parallel ingestion worker process
+worker_pool = None
+worker_index = None
+
+# months whose songplays partition this process created or found
+songplay_partitions = set()
+
+
+def ensure_songplay_partitions(cur, start_times):
+    """Create the monthly songplays partitions of the months in start_times that do not exist yet.
+
+    Parallel workers can create the same partition at the same time, the one that loses the race rolls back to a
+    savepoint and finds the partition there."""
+    for month in pd.Series(start_times).dropna().dt.to_period('M').unique():
+        if month in songplay_partitions:
+            continue
+        first = month.start_time
+        cur.execute('SAVEPOINT songplay_partition')
+        try:
+            cur.execute(songplay_partition_create.format('songplays_{:%Y_%m}'.format(first), first.date(),
+                                                         (month + 1).start_time.date()))
+        except (psycopg2.errors.DuplicateTable, psycopg2.errors.UniqueViolation):
+            cur.execute('ROLLBACK TO SAVEPOINT songplay_partition')
+        cur.execute('RELEASE SAVEPOINT songplay_partition')
+        songplay_partitions.add(month)
+
+
+def process_song_file(cur, filepaths, index=None):
+    """Read a batch of song data files and load data into song and artist table, adding the songs to index if given.
+    Returns the number of records read"""
+    # open the song files as one dataframe
+    df = read_json_batch(filepaths, SONG_DTYPES)
 
-def process_song_file(cur, filepath):
-    """Read every song data file and load data into song and artist table"""
-    # open song file
-    df = pd.read_json(filepath, lines=True)
-    # replace NaN values to None, this will be loaded as NULL in sql
-    df = df.where(pd.notnull(df), None)
-    
-    
     # column_name contains all the column headers for the song table
     column_name = ['song_id', 'title', 'artist_id', 'year', 'duration']
-    # Using the colum_name list we extract the corresponding song column data from the panda dataframe
-    song_data = tuple(df[column_name].values[0])
-    # insert song record
-    cur.execute(song_table_insert, song_data)
-    
+    # insert song records, NaN values are replaced with None once for the whole batch and loaded as NULL in sql
+    execute_batch(cur, song_table_insert, null_records(df[column_name]))
+
     # column_name contains all the column headers for the artist table
     column_name = ['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']
-    # Using the colum_name list we extract the corresponding artist column data from the panda dataframe
-    artist_data = tuple(df[column_name].values[0])
-    # insert artist record
-    cur.execute(artist_table_insert, artist_data)
+    # insert artist records
+    execute_batch(cur, artist_table_insert, null_records(df[column_name]))
 
+    # keep the song index in step with the songs table
+    if index is not None:
+        index.add_song_data(df)
+    return len(df)
 
-def process_log_file(cur, filepath):
-    """Read every log data file and load the batch of data into user, time and songplay table"""
-    
-    # open log file
-    df = pd.read_json(filepath, lines=True)
-    # replace NaN values to None, this will be loaded as NULL in sql
-    df = df.where(pd.notnull(df), None)
-
-    # filter by NextSong action
-    df = df.loc[df['page'] == 'NextSong']
 
-    # convert timestamp column to datetime
-    t = pd.to_datetime(df['ts'], unit='ms')
+def process_log_file(cur, filepaths, index=None):
+    """Read a batch of log data files and load the batch of data into user, time and songplay table.
+    Song and artist ids are resolved from index when given, otherwise with song_select for every row.
+    Returns the number of NextSong records read"""
     
-    # load a list of time data from the time dataframe. dt property from pandas is used to convert the timestamp into the required units
-    time_data = [list(t), list(t.dt.hour), list(t.dt.day), list(t.dt.week), list(t.dt.month), list(t.dt.year), list(t.dt.weekday)]
-    
-    # column_name contains all the column headers for the time table
-    column_labels = ['timestamp', 'hour', 'day', 'week', 'month', 'year', 'weekday']
-    
-    # time_dictionary is a dictionary with column names as the keys  linked to the corresponding values from time_data list
-    time_dictionary = dict(zip(column_labels, time_data))
-    
-    # using the dictionary created above to create a time panda dataframe that can be iterated through to create the needed time records
-    time_df = pd.DataFrame.from_dict(time_dictionary) 
+    # open the NextSong records of the log files as one dataframe with only the columns used below
+    df = read_log_batch(filepaths)
+    records = len(df)
 
-    # insert time data records by looping through the time dataframe
-    for i, row in time_df.iterrows():
-        cur.execute(time_table_insert, list(row))
+    # insert the time records of the timestamps not loaded yet
+    time_df = new_time_rows(cur, time_frame(df['ts']))
+    execute_batch(cur, time_table_insert, null_records(time_df))
 
     # load user table
     
@@ -67,15 +92,30 @@ def process_log_file(cur, filepath):
     # droping duplicate records from the dataframe, this will decrease the number of redundant insert statements for the user table
     user_df = user_df.drop_duplicates() 
 
-    # insert user data records by looping through the user dataframe
-    for i, row in user_df.iterrows():
-        cur.execute(user_table_insert, row)
+    # insert user data records
+    execute_batch(cur, user_table_insert, null_records(user_df))
 
     # insert songplay records
-    for index, row in df.iterrows():
+    if index is not None:
+        # resolve the song and artist ids of the whole log dataframe in one merge, only the
+        # columns of the matched rows are copied into the songplays
+        ids = index.lookup(df)
+        matched = ids['song_id'].notnull().to_numpy()
+        songplay_df = pd.DataFrame({'start_time': pd.to_datetime(df['ts'][matched], unit='ms'), 'user_id': df['userId'][matched],
+                                    'level': df['level'][matched], 'song_id': ids['song_id'][matched],
+                                    'artist_id': ids['artist_id'][matched], 'session_id': df['sessionId'][matched],
+                                    'location': df['location'][matched], 'user_agent': df['userAgent'][matched]})
+        ensure_songplay_partitions(cur, songplay_df['start_time'])
+        execute_batch(cur, songplay_table_insert, null_records(songplay_df))
+        return records
+
+    ensure_songplay_partitions(cur, pd.to_datetime(df['ts'], unit='ms'))
+    # python values of the columns of the songplays, NULL values as None
+    songplay_columns = ['song', 'artist', 'length', 'ts', 'userId', 'level', 'sessionId', 'location', 'userAgent']
+    for song, artist, length, ts, user_id, level, session_id, location, user_agent in null_records(df[songplay_columns]):
         
         # get songid and artistid from song and artist tables
-        cur.execute(song_select, (row.song, row.artist, row.length))
+        cur.execute(song_select, (song, artist, length))
         results = cur.fetchone()
         
         if results:
@@ -88,38 +128,296 @@ def process_log_file(cur, filepath):
             # create a list of data for the columns in the songplay table
             # all the data except songid and artsitid comes from the log data panda dataframe
             # the songid and artistid is fetched in the song_select query above
-            songplay_data = (pd.to_datetime(row.ts, unit='ms'), row.userId, row.level, songid, artistid, row.sessionId, row.location, row.userAgent)
+            songplay_data = (pd.to_datetime(ts, unit='ms'), user_id, level, songid, artistid, session_id, location, user_agent)
             cur.execute(songplay_table_insert, songplay_data)
+    return records
+
+
+def time_frame(ts):
+    """Build the time table rows of the distinct timestamps in ts, given in milliseconds, in one vectorized pass"""
+    t = pd.Series(pd.to_datetime(ts.dropna().drop_duplicates().astype('int64'), unit='ms'), name='start_time')
+    week = t.dt.isocalendar().week.astype('int64')
+    return pd.DataFrame({'start_time': t, 'hour': t.dt.hour, 'day': t.dt.day, 'week': week,
+                         'month': t.dt.month, 'year': t.dt.year, 'weekday': t.dt.weekday})
+
 
+def new_time_rows(cur, time_df):
+    """Drop the rows of time_df whose start_time is already in the time table"""
+    if time_df.empty:
+        return time_df
+    cur.execute(time_loaded_select, (time_df['start_time'].min().to_pydatetime(), time_df['start_time'].max().to_pydatetime()))
+    loaded = pd.to_datetime([row[0] for row in cur.fetchall()])
+    return time_df.loc[~time_df['start_time'].isin(loaded)]
 
-def process_data(cur, conn, filepath, func):
-    """Gather all the song or log data files. Iterate through the list of files and call the process function for each file"""
-    # get all files matching extension from directory
+
+def get_files(filepath):
+    """Gather all the json data files under filepath"""
     all_files = []
     for root, dirs, files in os.walk(filepath):
         files = glob.glob(os.path.join(root,'*.json'))
         for f in files :
             all_files.append(os.path.abspath(f))
+    return all_files
+
+
+def select_files(cur, conn, filepath, incremental=False):
+    """Gather the json data files under filepath, in incremental mode only the files not yet in the ingested_files manifest
+    or changed since. Returns the files and their manifest entries by path"""
+    all_files = get_files(filepath)
+    if not incremental:
+        return all_files, {}
+    entries = {entry.path: entry for entry in pending_files(cur, all_files)}
+    conn.commit()
+    return list(entries), entries
+
+
+def process_data(cur, conn, filepath, func, batch_size=1, incremental=False):
+    """Gather all the song or log data files. Iterate through the list of files and call the process function for every batch of batch_size files"""
+    # get all files matching extension from directory, in incremental mode only the new or changed ones
+    all_files, entries = select_files(cur, conn, filepath, incremental)
 
     # get total number of files found
     num_files = len(all_files)
     print('{} files found in {}'.format(num_files, filepath))
 
-    # iterate over files and process
-    for i, datafile in enumerate(all_files, 1):
-        func(cur, datafile)
+    # iterate over batches of files and process
+    with metrics.stage('process_data ' + os.path.basename(filepath.rstrip('/')), batch_size=batch_size) as counts:
+        counts.update(files=num_files, bytes_read=sum(os.path.getsize(f) for f in all_files), rows_read=0)
+        for i in range(0, num_files, batch_size):
+            batch = all_files[i:i + batch_size]
+            counts['rows_read'] += func(cur, batch)
+            # the manifest is committed with the data of the batch, an interrupted run resumes at the first uncommitted batch
+            if incremental:
+                record_files(cur, [entries[f] for f in batch])
+            conn.commit()
+            print('{}/{} files processed.'.format(i + len(batch), num_files))
+
+
+def init_worker(with_index):
+    """Open the connection pool of a parallel ingestion worker and load its song index if needed"""
+    global worker_pool, worker_index
+    worker_pool = psycopg2.pool.SimpleConnectionPool(1, 1, DSN)
+    if with_index:
+        conn = worker_pool.getconn()
+        worker_index = SongIndex.from_database(conn.cursor())
+        conn.rollback()
+        worker_pool.putconn(conn)
+
+
+def process_file_batch(func, task):
+    """Process a batch of files in a worker process as one dataframe with a single commit for the whole batch.
+    task is the list of files and the manifest entries recorded with them in incremental mode"""
+    filepaths, entries = task
+    start = time.perf_counter()
+    conn = worker_pool.getconn()
+    try:
+        for attempt in range(1, BATCH_RETRIES + 1):
+            cur = conn.cursor()
+            try:
+                rows = func(cur, filepaths, index=worker_index)
+                record_files(cur, entries)
+                conn.commit()
+                break
+            except psycopg2.extensions.TransactionRollbackError:
+                # another worker upserted the same users in a different order, redo the batch
+                conn.rollback()
+                # partitions created by the batch were rolled back with it
+                songplay_partitions.clear()
+                if attempt == BATCH_RETRIES:
+                    raise
+    finally:
+        worker_pool.putconn(conn)
+    return os.getpid(), len(filepaths), rows, time.perf_counter() - start
+
+
+def parallel_process_data(cur, conn, filepath, func, workers, commit_batch, with_index=False, incremental=False):
+    """Spread the data files under filepath over a pool of worker processes and report the throughput of every worker"""
+    all_files, entries = select_files(cur, conn, filepath, incremental)
+    num_files = len(all_files)
+    print('{} files found in {}'.format(num_files, filepath))
+
+    batches = []
+    for i in range(0, num_files, commit_batch):
+        batch = all_files[i:i + commit_batch]
+        batches.append((batch, [entries[f] for f in batch if f in entries]))
+    stats = {}
+    processed = 0
+    with metrics.stage('process_data ' + os.path.basename(filepath.rstrip('/')), workers=workers) as counts, \
+            multiprocessing.Pool(workers, initializer=init_worker, initargs=(with_index,)) as pool:
+        counts.update(files=num_files, bytes_read=sum(os.path.getsize(f) for f in all_files), rows_read=0)
+        for pid, count, rows, elapsed in pool.imap_unordered(partial(process_file_batch, func), batches):
+            files, seconds = stats.get(pid, (0, 0.0))
+            stats[pid] = (files + count, seconds + elapsed)
+            processed += count
+            counts['rows_read'] += rows
+            print('{}/{} files processed.'.format(processed, num_files))
+
+    for pid, (files, seconds) in sorted(stats.items()):
+        print('worker {}: {} files in {:.2f}s ({:.1f} files/sec)'.format(
+            pid, files, seconds, files / seconds if seconds else 0))
+
+
+def song_frames(df):
+    """Split a song data dataframe into the rows of the songs and artists tables"""
+    songs = df[['song_id', 'title', 'artist_id', 'year', 'duration']]
+    artists = df[['artist_id', 'artist_name', 'artist_location', 'artist_latitude', 'artist_longitude']]
+    artists = artists.rename(columns={'artist_name': 'name', 'artist_location': 'location',
+                                      'artist_latitude': 'latitude', 'artist_longitude': 'longitude'})
+    return {'songs': songs, 'artists': artists}
+
+
+def log_frames(df):
+    """Split a NextSong log dataframe into the rows of the users, time and songplays tables"""
+    t = pd.to_datetime(df['ts'], unit='ms')
+    user_id = pd.to_numeric(df['userId'], errors='coerce').astype('Int64')
+
+    users = pd.DataFrame({'user_id': user_id, 'first_name': df['firstName'], 'last_name': df['lastName'],
+                          'gender': df['gender'], 'level': df['level'], 'ts': df['ts']})
+
+    songplays = pd.DataFrame({'start_time': t, 'user_id': user_id, 'level': df['level'],
+                              'session_id': df['sessionId'], 'location': df['location'],
+                              'user_agent': df['userAgent'], 'song': df['song'],
+                              'artist': df['artist'], 'length': df['length']})
+    return {'users': users, 'time': time_frame(df['ts']), 'songplays': songplays}
+
+
+def copy_dataframe(cur, df, table):
+    """Stream the rows of a dataframe into table with COPY FROM STDIN"""
+    # empty csv fields are loaded as NULL
+    buffer = io.StringIO()
+    df.to_csv(buffer, index=False, header=False)
+    buffer.seek(0)
+    cur.copy_expert(copy_from_stdin.format(table, ', '.join(df.columns)), buffer)
+
+
+def batches(filepaths, batch_size, batch_bytes=None):
+    """Split a list of files into lists of at most batch_size files and, when given, batch_bytes bytes. A file larger
+    than batch_bytes is a batch of its own"""
+    batch, size = [], 0
+    for filepath in filepaths:
+        file_size = os.path.getsize(filepath)
+        if batch and (len(batch) == batch_size or (batch_bytes and size + file_size > batch_bytes)):
+            yield batch
+            batch, size = [], 0
+        batch.append(filepath)
+        size += file_size
+    if batch:
+        yield batch
+
+
+def bulk_load(cur, conn, song_files, log_files, entries=(), defer_indexes=False, copy_batch=1000, copy_batch_bytes=32 * 2 ** 20):
+    """Copy the song and log files into temp staging tables and merge them into the star schema with set based inserts.
+
+    The files are read and copied in batches of copy_batch files and copy_batch_bytes bytes, so only one batch is held
+    in memory whatever the size of the data set, and the staging tables are merged once after the last batch. The
+    manifest entries of the files are recorded in the same transaction. With defer_indexes the secondary indexes are
+    dropped before the merges and built once after them instead of being updated row by row"""
+    # one transaction for the whole load, the staging tables are dropped on commit
+    for table, staging_create, merge in bulk_load_queries:
+        cur.execute(staging_create)
+    staged = {table: 0 for table, staging_create, merge in bulk_load_queries}
+
+    for files, read, split in [(song_files, lambda batch: read_json_batch(batch, SONG_DTYPES), song_frames),
+                               (log_files, read_log_batch, log_frames)]:
+        for batch in batches(files, copy_batch, copy_batch_bytes):
+            with metrics.stage('bulk_load copy') as counts:
+                df = read(batch)
+                counts.update(files=len(batch), bytes_read=sum(os.path.getsize(f) for f in batch), rows_read=len(df))
+                counts['rows_written'] = 0
+                for table, frame in split(df).items():
+                    if table == 'songplays':
+                        ensure_songplay_partitions(cur, frame['start_time'])
+                    copy_dataframe(cur, frame, table + '_staging')
+                    staged[table] += len(frame)
+                    counts['rows_written'] += len(frame)
+            del df
+
+    if defer_indexes:
+        for query in drop_index_queries:
+            cur.execute(query)
+    for table, staging_create, merge in bulk_load_queries:
+        if not staged[table]:
+            continue
+        start = time.perf_counter()
+        with metrics.stage('bulk_load ' + table) as counts:
+            cur.execute(merge)
+            counts.update(rows_read=staged[table], rows_written=cur.rowcount)
+        elapsed = time.perf_counter() - start
+        print('{}: {} rows staged, {} rows merged in {:.2f}s ({:.0f} rows/sec)'.format(
+            table, staged[table], cur.rowcount, elapsed, staged[table] / elapsed if elapsed else 0))
+    if defer_indexes:
+        with metrics.stage('bulk_load indexes'):
+            for query in create_index_queries:
+                cur.execute(query)
+    record_files(cur, list(entries))
+    conn.commit()
+
+
+def refresh_rollups(cur, conn):
+    """Add the songplays inserted since the last refresh to the rollup tables and move the rollup watermark,
+    in one transaction. Returns the number of songplays added"""
+    start = time.perf_counter()
+    with metrics.stage('refresh_rollups') as counts:
+        for query in rollup_refresh_queries:
+            metrics.execute(cur, query)
+            if query == new_songplays_create:
+                counts['rows_read'] = new_rows = cur.rowcount
         conn.commit()
-        print('{}/{} files processed.'.format(i, num_files))
+    print('rollups: {} new songplays added in {:.2f}s'.format(new_rows, time.perf_counter() - start))
+    return new_rows
 
 
 def main():
-    conn = psycopg2.connect("host=127.0.0.1 dbname=sparkifydb user=student password=student")
+    parser = argparse.ArgumentParser(description='Load the song and log data into sparkifydb')
+    parser.add_argument('--mode', choices=['row', 'bulk', 'parallel'], default='row',
+                        help='row inserts every record on its own, bulk uses COPY into staging tables, '
+                             'parallel spreads the files over worker processes')
+    parser.add_argument('--batch-size', type=int, default=1,
+                        help='number of files read into one dataframe and committed together in row mode')
+    parser.add_argument('--workers', type=int, default=multiprocessing.cpu_count(),
+                        help='number of worker processes in parallel mode')
+    parser.add_argument('--commit-batch', type=int, default=50,
+                        help='number of files a worker processes between commits in parallel mode')
+    parser.add_argument('--copy-batch', type=int, default=1000,
+                        help='number of files read and copied into the staging tables at a time in bulk mode')
+    parser.add_argument('--copy-batch-mb', type=int, default=32,
+                        help='most megabytes of files read and copied into the staging tables at a time in bulk mode')
+    parser.add_argument('--incremental', action='store_true',
+                        help='only load the files that are not in the ingested_files manifest or changed since')
+    parser.add_argument('--metrics-log', help='file of the json stage logs, stderr when not given')
+    parser.add_argument('--prometheus-file', help='write the stage totals to this Prometheus text file')
+    args = parser.parse_args()
+
+    metrics.configure('p1_etl', args.metrics_log, args.prometheus_file)
+    conn = psycopg2.connect(DSN)
     cur = conn.cursor()
 
-    process_data(cur, conn, filepath='data/song_data', func=process_song_file)
-    process_data(cur, conn, filepath='data/log_data', func=process_log_file)
+    if args.mode == 'bulk':
+        song_files, song_entries = select_files(cur, conn, 'data/song_data', args.incremental)
+        log_files, log_entries = select_files(cur, conn, 'data/log_data', args.incremental)
+        # a full load builds the indexes once at the end, an incremental load keeps them and updates them
+        bulk_load(cur, conn, song_files, log_files, entries=list(song_entries.values()) + list(log_entries.values()),
+                  defer_indexes=not args.incremental, copy_batch=args.copy_batch,
+                  copy_batch_bytes=args.copy_batch_mb * 2 ** 20)
+    elif args.mode == 'parallel':
+        # all songs must be loaded before the log workers build their song index
+        parallel_process_data(cur, conn, 'data/song_data', process_song_file, args.workers, args.commit_batch,
+                              incremental=args.incremental)
+        parallel_process_data(cur, conn, 'data/log_data', process_log_file, args.workers, args.commit_batch,
+                              with_index=True, incremental=args.incremental)
+    else:
+        # songs already in the database are indexed once, new songs are added as their files are processed
+        index = SongIndex.from_database(cur)
+        process_data(cur, conn, filepath='data/song_data', func=partial(process_song_file, index=index),
+                     batch_size=args.batch_size, incremental=args.incremental)
+        process_data(cur, conn, filepath='data/log_data', func=partial(process_log_file, index=index),
+                     batch_size=args.batch_size, incremental=args.incremental)
+
+    # the rollups only see committed songplays, so they are refreshed once every load of the run is done
+    refresh_rollups(cur, conn)
 
     conn.close()
+    metrics.write_prometheus()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,48 @@
+import os
+import hashlib
+from collections import namedtuple
+from psycopg2.extras import execute_batch
+from sql_queries import ingested_files_select, ingested_file_upsert
+
+FileEntry = namedtuple('FileEntry', ['path', 'size', 'mtime', 'content_hash'])
+
+
+def content_hash(filepath):
+    """Return the md5 hex digest of the content of a file"""
+    digest = hashlib.md5()
+    with open(filepath, 'rb') as f:
+        for chunk in iter(lambda: f.read(1 << 20), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def pending_files(cur, filepaths):
+    """Return the entries of the files that are new or changed since they were recorded in ingested_files.
+
+    Files with the size and mtime of their manifest entry are skipped without reading them. A file whose
+    mtime changed but whose content hash did not is only touched in the manifest, the caller commits it.
+    """
+    cur.execute(ingested_files_select)
+    manifest = {row[0]: FileEntry(*row) for row in cur.fetchall()}
+
+    pending = []
+    touched = []
+    for filepath in filepaths:
+        stat = os.stat(filepath)
+        known = manifest.get(filepath)
+        if known is not None and known.size == stat.st_size and known.mtime == stat.st_mtime:
+            continue
+        entry = FileEntry(filepath, stat.st_size, stat.st_mtime, content_hash(filepath))
+        if known is not None and known.content_hash == entry.content_hash:
+            touched.append(entry)
+        else:
+            pending.append(entry)
+
+    record_files(cur, touched)
+    print('{} of {} files are new or changed'.format(len(pending), len(filepaths)))
+    return pending
+
+
+def record_files(cur, entries):
+    """Record files as ingested, called in the same transaction that loads their data"""
+    execute_batch(cur, ingested_file_upsert, entries)
@@ -0,0 +1,80 @@
+import numpy as np
+import pandas as pd
+from pandas.util import hash_pandas_object
+from sql_queries import song_index_select
+
+KEY_COLUMNS = ['title', 'name', 'duration']
+
+
+def lookup_keys(title, name, duration):
+    """The (title, artist name, duration) triple of every row and its hash as one uint64 key"""
+    key_df = pd.DataFrame({'title': pd.Series(title, dtype=object).values,
+                           'name': pd.Series(name, dtype=object).values,
+                           'duration': pd.to_numeric(pd.Series(duration).values, errors='coerce').astype('float64')})
+    key_df['key'] = hash_pandas_object(key_df, index=False).values
+    return key_df
+
+
+class SongIndex:
+    """In-memory lookup of song_id and artist_id by song title, artist name and duration.
+
+    Replaces running song_select for every log row: the index is built once and the
+    songplays of a whole log dataframe are resolved with a single merge. The merge joins
+    on the hash of the triple, and a hit is only a match when the triple itself is equal,
+    so a hash collision never attaches the ids of another song.
+    """
+
+    def __init__(self):
+        self._frame = pd.DataFrame({'title': pd.Series(dtype=object), 'name': pd.Series(dtype=object),
+                                    'duration': pd.Series(dtype='float64'), 'key': pd.Series(dtype='uint64'),
+                                    'song_id': pd.Series(dtype=object), 'artist_id': pd.Series(dtype=object)})
+        # songs added since the last lookup, concatenated lazily so adding one song file stays cheap
+        self._pending = []
+
+    @classmethod
+    def from_database(cls, cur):
+        """Build the index from the songs and artists tables"""
+        index = cls()
+        cur.execute(song_index_select)
+        rows = pd.DataFrame(cur.fetchall(), columns=['title', 'name', 'duration', 'song_id', 'artist_id'])
+        index.add(rows['title'], rows['name'], rows['duration'], rows['song_id'], rows['artist_id'])
+        return index
+
+    def add(self, title, name, duration, song_id, artist_id):
+        """Add songs to the index, songs already in the index keep their ids"""
+        rows = lookup_keys(title, name, duration)
+        rows['song_id'] = pd.Series(song_id, dtype=object).values
+        rows['artist_id'] = pd.Series(artist_id, dtype=object).values
+        self._pending.append(rows)
+
+    def add_song_data(self, df):
+        """Add the songs of a song data dataframe to the index"""
+        self.add(df['title'], df['artist_name'], df['duration'], df['song_id'], df['artist_id'])
+
+    def _consolidate(self):
+        if self._pending:
+            # like song_select with fetchone, the first song found for a key wins
+            self._frame = pd.concat([self._frame] + self._pending, ignore_index=True) \
+                .drop_duplicates(subset=KEY_COLUMNS, keep='first')
+            self._pending = []
+        return self._frame
+
+    def __len__(self):
+        return len(self._consolidate())
+
+    def lookup(self, df, title='song', name='artist', duration='length'):
+        """Return the song_id and artist_id of every row of df as a dataframe with the index of df, NaN where the song
+        is not in the index. df itself is not copied"""
+        frame = self._consolidate()
+        keys = lookup_keys(df[title], df[name], df[duration])
+        keys['row'] = np.arange(len(keys))
+        found = keys.merge(frame, on='key', how='left', suffixes=('', '_song'))
+        # a hash hit of another triple is a collision, not a match
+        same = found['title'].eq(found['title_song']) & found['name'].eq(found['name_song']) & \
+            (found['duration'].eq(found['duration_song']) | found['duration'].isna() & found['duration_song'].isna())
+        found.loc[~same, ['song_id', 'artist_id']] = np.nan
+        if len(found) > len(keys):
+            # the key of a row hit several songs, keep the one with the same triple
+            found = found.assign(same=same).sort_values(['row', 'same'], ascending=[True, False], kind='stable') \
+                .drop_duplicates(subset='row')
+        return found[['song_id', 'artist_id']].set_index(df.index)
@@ -5,21 +5,36 @@ user_table_drop = "drop table if exists users"
 song_table_drop = "drop table if exists songs"
 artist_table_drop = "drop table if exists artists"
 time_table_drop = "drop table if exists time"
+ingested_files_table_drop = "drop table if exists ingested_files"
+hourly_plays_table_drop = "drop table if exists hourly_plays"
+daily_song_plays_table_drop = "drop table if exists daily_song_plays"
+daily_artist_plays_table_drop = "drop table if exists daily_artist_plays"
+daily_user_levels_table_drop = "drop table if exists daily_user_levels"
+rollup_watermark_table_drop = "drop table if exists rollup_watermark"
 
 # CREATE TABLES
 
+# songplays is range partitioned by start_time month, the partitions are created by the etl as their months show up
+# in the log data (songplay_partition_create). Keys of a partitioned table must include start_time
 songplay_table_create = ("\
 CREATE TABLE IF NOT EXISTS songplays (\
-songplay_id serial PRIMARY KEY, \
-start_time timestamp without time zone, \
+songplay_id serial, \
+start_time timestamp without time zone NOT NULL, \
 user_id int,\
 level varchar, \
 song_id varchar, \
 artist_id varchar, \
 session_id int, \
 location varchar, \
-user_agent varchar \
-)")
+user_agent varchar, \
+PRIMARY KEY (songplay_id, start_time), \
+UNIQUE (start_time, user_id, session_id) \
+) PARTITION BY RANGE (start_time)")
+
+# one month of songplays, named songplays_YYYY_MM
+songplay_partition_create = ("""CREATE TABLE IF NOT EXISTS {} PARTITION OF songplays
+FOR VALUES FROM ('{}') TO ('{}')
+""")
 
 user_table_create = ("\
 CREATE TABLE IF NOT EXISTS users (\
@@ -50,7 +65,7 @@ longitude int NULL \
 
 time_table_create = ("\
 CREATE TABLE IF NOT EXISTS time (\
-start_time timestamp without time zone, \
+start_time timestamp without time zone PRIMARY KEY, \
 hour int, \
 day int, \
 week int, \
@@ -59,11 +74,74 @@ year int, \
 weekday int \
 )")
 
+# manifest of the data files already loaded, used by the incremental mode of etl.py
+ingested_files_table_create = ("""CREATE TABLE IF NOT EXISTS ingested_files (
+path varchar PRIMARY KEY,
+size bigint NOT NULL,
+mtime double precision NOT NULL,
+content_hash varchar NOT NULL,
+ingested_at timestamp without time zone DEFAULT now()
+)""")
+
+# ROLLUP TABLES
+# aggregates of songplays for the dashboard queries of dashboard_queries.py, refreshed by the etl from the songplays
+# inserted since the last refresh. daily_user_levels is the distinct set of users per day and level, so the free and
+# paid users of a day are counted from it without counting distinct over songplays
+
+hourly_plays_table_create = ("""CREATE TABLE IF NOT EXISTS hourly_plays (
+hour timestamp without time zone PRIMARY KEY,
+plays bigint NOT NULL
+)""")
+
+daily_song_plays_table_create = ("""CREATE TABLE IF NOT EXISTS daily_song_plays (
+day date,
+song_id varchar,
+plays bigint NOT NULL,
+PRIMARY KEY (day, song_id)
+)""")
+
+daily_artist_plays_table_create = ("""CREATE TABLE IF NOT EXISTS daily_artist_plays (
+day date,
+artist_id varchar,
+plays bigint NOT NULL,
+PRIMARY KEY (day, artist_id)
+)""")
+
+daily_user_levels_table_create = ("""CREATE TABLE IF NOT EXISTS daily_user_levels (
+day date,
+level varchar,
+user_id int,
+PRIMARY KEY (day, level, user_id)
+)""")
+
+# highest songplay_id already added to the rollups
+rollup_watermark_table_create = ("""CREATE TABLE IF NOT EXISTS rollup_watermark (
+source varchar PRIMARY KEY,
+max_songplay_id bigint NOT NULL
+)""")
+
+# INDEXES
+
+# the lookup of song_select and the songplays merge, songs by title and duration and artists by name
+song_lookup_index_create = "CREATE INDEX IF NOT EXISTS songs_title_duration_idx ON songs (title, duration)"
+artist_lookup_index_create = "CREATE INDEX IF NOT EXISTS artists_name_idx ON artists (name)"
+
+# analytics filters on songplays, created on every partition. start_time needs no index of its own: the month
+# partitions are pruned by it and the unique key index of every partition starts with it
+songplay_user_index_create = "CREATE INDEX IF NOT EXISTS songplays_user_id_idx ON songplays (user_id)"
+songplay_song_index_create = "CREATE INDEX IF NOT EXISTS songplays_song_id_idx ON songplays (song_id)"
+
+song_lookup_index_drop = "DROP INDEX IF EXISTS songs_title_duration_idx"
+artist_lookup_index_drop = "DROP INDEX IF EXISTS artists_name_idx"
+songplay_user_index_drop = "DROP INDEX IF EXISTS songplays_user_id_idx"
+songplay_song_index_drop = "DROP INDEX IF EXISTS songplays_song_id_idx"
+
 # INSERT RECORDS
 
 songplay_table_insert = ("""INSERT INTO songplays 
 (start_time, user_id, level, song_id, artist_id, session_id, location, user_agent) 
 values (%s, %s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (start_time, user_id, session_id) DO NOTHING
 """)
 
 user_table_insert = ("""INSERT INTO users (user_id, first_name, last_name, gender, level)
@@ -72,16 +150,284 @@ ON CONFLICT (user_id) DO UPDATE
 SET level = EXCLUDED.level
 """)
 
-song_table_insert = ("INSERT INTO songs (song_id, title, artist_id, year, duration) \
-values (%s, %s, %s, %s, %s)")
+song_table_insert = ("""INSERT INTO songs (song_id, title, artist_id, year, duration)
+values (%s, %s, %s, %s, %s)
+ON CONFLICT (song_id) DO NOTHING
+""")
 
 artist_table_insert = ("""INSERT INTO artists (artist_id, name, location, latitude, longitude)
 values (%s, %s, %s, %s, %s)
 ON CONFLICT (artist_id) DO NOTHING
 """)
 
-time_table_insert = ("INSERT INTO time (start_time, hour, day, week, month, year, weekday) \
-values (%s, %s, %s, %s, %s, %s, %s)")
+time_table_insert = ("""INSERT INTO time (start_time, hour, day, week, month, year, weekday)
+values (%s, %s, %s, %s, %s, %s, %s)
+ON CONFLICT (start_time) DO NOTHING
+""")
+
+ingested_file_upsert = ("""INSERT INTO ingested_files (path, size, mtime, content_hash)
+values (%s, %s, %s, %s)
+ON CONFLICT (path) DO UPDATE
+SET size = EXCLUDED.size, mtime = EXCLUDED.mtime, content_hash = EXCLUDED.content_hash, ingested_at = now()
+""")
+
+# BULK LOAD
+
+# rows are streamed with COPY FROM STDIN into temp staging tables that are dropped on commit
+copy_from_stdin = "COPY {} ({}) FROM STDIN WITH (FORMAT csv)"
+
+songs_staging_create = ("""CREATE TEMP TABLE songs_staging (
+song_id varchar,
+title varchar,
+artist_id varchar,
+year int,
+duration numeric
+) ON COMMIT DROP
+""")
+
+artists_staging_create = ("""CREATE TEMP TABLE artists_staging (
+artist_id varchar,
+name varchar,
+location varchar,
+latitude numeric,
+longitude numeric
+) ON COMMIT DROP
+""")
+
+users_staging_create = ("""CREATE TEMP TABLE users_staging (
+user_id int,
+first_name varchar,
+last_name varchar,
+gender varchar,
+level varchar,
+ts bigint
+) ON COMMIT DROP
+""")
+
+time_staging_create = ("""CREATE TEMP TABLE time_staging (
+start_time timestamp without time zone,
+hour int,
+day int,
+week int,
+month int,
+year int,
+weekday int
+) ON COMMIT DROP
+""")
+
+songplays_staging_create = ("""CREATE TEMP TABLE songplays_staging (
+start_time timestamp without time zone,
+user_id int,
+level varchar,
+session_id int,
+location varchar,
+user_agent varchar,
+song varchar,
+artist varchar,
+length numeric
+) ON COMMIT DROP
+""")
+
+# the merge statements keep the conflict handling of the per-row inserts above
+song_table_merge = ("""INSERT INTO songs (song_id, title, artist_id, year, duration)
+SELECT DISTINCT ON (song_id) song_id, title, artist_id, year, duration
+FROM songs_staging
+ON CONFLICT (song_id) DO NOTHING
+""")
+
+artist_table_merge = ("""INSERT INTO artists (artist_id, name, location, latitude, longitude)
+SELECT DISTINCT ON (artist_id) artist_id, name, location, latitude, longitude
+FROM artists_staging
+ON CONFLICT (artist_id) DO NOTHING
+""")
+
+# a user can only be updated once per statement, so keep the most recent record of every user
+user_table_merge = ("""INSERT INTO users (user_id, first_name, last_name, gender, level)
+SELECT DISTINCT ON (user_id) user_id, first_name, last_name, gender, level
+FROM users_staging
+WHERE user_id IS NOT NULL
+ORDER BY user_id, ts DESC
+ON CONFLICT (user_id) DO UPDATE
+SET level = EXCLUDED.level
+""")
+
+time_table_merge = ("""INSERT INTO time (start_time, hour, day, week, month, year, weekday)
+SELECT DISTINCT ON (start_time) start_time, hour, day, week, month, year, weekday
+FROM time_staging
+ON CONFLICT (start_time) DO NOTHING
+""")
+
+# same match as song_select, done for the whole batch in one join
+songplay_table_merge = ("""INSERT INTO songplays
+(start_time, user_id, level, song_id, artist_id, session_id, location, user_agent)
+SELECT e.start_time, e.user_id, e.level, s.song_id, a.artist_id, e.session_id, e.location, e.user_agent
+FROM songplays_staging e
+INNER JOIN songs s
+ON s.title = e.song
+AND s.duration = e.length
+INNER JOIN artists a
+ON a.artist_id = s.artist_id
+AND a.name = e.artist
+ON CONFLICT (start_time, user_id, session_id) DO NOTHING
+""")
+
+# ROLLUP REFRESH
+# the songplays above the watermark are copied once into a temp table, added to every rollup and the watermark moves
+# in the same transaction. songplay_id is a serial, so the refresh must run after the loads of the run have committed
+
+new_songplays_create = ("""CREATE TEMP TABLE new_songplays ON COMMIT DROP AS
+SELECT songplay_id, start_time, user_id, level, song_id, artist_id
+FROM songplays
+WHERE songplay_id > (SELECT coalesce(max(max_songplay_id), 0) FROM rollup_watermark WHERE source = 'songplays')
+""")
+
+hourly_plays_merge = ("""INSERT INTO hourly_plays (hour, plays)
+SELECT date_trunc('hour', start_time), count(*)
+FROM new_songplays
+GROUP BY 1
+ON CONFLICT (hour) DO UPDATE
+SET plays = hourly_plays.plays + EXCLUDED.plays
+""")
+
+daily_song_plays_merge = ("""INSERT INTO daily_song_plays (day, song_id, plays)
+SELECT start_time::date, song_id, count(*)
+FROM new_songplays
+WHERE song_id IS NOT NULL
+GROUP BY 1, 2
+ON CONFLICT (day, song_id) DO UPDATE
+SET plays = daily_song_plays.plays + EXCLUDED.plays
+""")
+
+daily_artist_plays_merge = ("""INSERT INTO daily_artist_plays (day, artist_id, plays)
+SELECT start_time::date, artist_id, count(*)
+FROM new_songplays
+WHERE artist_id IS NOT NULL
+GROUP BY 1, 2
+ON CONFLICT (day, artist_id) DO UPDATE
+SET plays = daily_artist_plays.plays + EXCLUDED.plays
+""")
+
+daily_user_levels_merge = ("""INSERT INTO daily_user_levels (day, level, user_id)
+SELECT DISTINCT start_time::date, level, user_id
+FROM new_songplays
+WHERE level IS NOT NULL
+AND user_id IS NOT NULL
+ON CONFLICT (day, level, user_id) DO NOTHING
+""")
+
+rollup_watermark_upsert = ("""INSERT INTO rollup_watermark (source, max_songplay_id)
+SELECT 'songplays', max(songplay_id)
+FROM new_songplays
+HAVING count(*) > 0
+ON CONFLICT (source) DO UPDATE
+SET max_songplay_id = EXCLUDED.max_songplay_id
+""")
+
+# DASHBOARD QUERIES
+# every question as a query on the rollups and the same query on the raw tables, both take the [start, end) range
+# and return the same rows. The rollups answer only when no songplays were inserted since their last refresh
+
+rollups_current_select = ("""SELECT coalesce((SELECT max(max_songplay_id) FROM rollup_watermark WHERE source = 'songplays'), 0)
+>= coalesce((SELECT max(songplay_id) FROM songplays), 0)
+""")
+
+# first and last songplay, the default range of the questions
+songplays_range_select = "SELECT min(start_time), max(start_time) FROM songplays"
+
+hourly_plays_select = ("""SELECT hour, plays
+FROM hourly_plays
+WHERE hour >= %(start)s
+AND hour < %(end)s
+ORDER BY hour
+""")
+
+hourly_plays_raw_select = ("""SELECT date_trunc('hour', start_time) AS hour, count(*) AS plays
+FROM songplays
+WHERE start_time >= %(start)s
+AND start_time < %(end)s
+GROUP BY 1
+ORDER BY 1
+""")
+
+top_songs_select = ("""SELECT p.song_id, s.title, p.plays
+FROM (
+    SELECT song_id, sum(plays)::bigint AS plays
+    FROM daily_song_plays
+    WHERE day >= %(start)s
+    AND day < %(end)s
+    GROUP BY song_id
+    ORDER BY plays DESC, song_id
+    LIMIT %(limit)s
+) p
+LEFT JOIN songs s
+ON s.song_id = p.song_id
+ORDER BY p.plays DESC, p.song_id
+""")
+
+top_songs_raw_select = ("""SELECT p.song_id, s.title, p.plays
+FROM (
+    SELECT song_id, count(*) AS plays
+    FROM songplays
+    WHERE start_time >= %(start)s
+    AND start_time < %(end)s
+    AND song_id IS NOT NULL
+    GROUP BY song_id
+    ORDER BY plays DESC, song_id
+    LIMIT %(limit)s
+) p
+LEFT JOIN songs s
+ON s.song_id = p.song_id
+ORDER BY p.plays DESC, p.song_id
+""")
+
+top_artists_select = ("""SELECT p.artist_id, a.name, p.plays
+FROM (
+    SELECT artist_id, sum(plays)::bigint AS plays
+    FROM daily_artist_plays
+    WHERE day >= %(start)s
+    AND day < %(end)s
+    GROUP BY artist_id
+    ORDER BY plays DESC, artist_id
+    LIMIT %(limit)s
+) p
+LEFT JOIN artists a
+ON a.artist_id = p.artist_id
+ORDER BY p.plays DESC, p.artist_id
+""")
+
+top_artists_raw_select = ("""SELECT p.artist_id, a.name, p.plays
+FROM (
+    SELECT artist_id, count(*) AS plays
+    FROM songplays
+    WHERE start_time >= %(start)s
+    AND start_time < %(end)s
+    AND artist_id IS NOT NULL
+    GROUP BY artist_id
+    ORDER BY plays DESC, artist_id
+    LIMIT %(limit)s
+) p
+LEFT JOIN artists a
+ON a.artist_id = p.artist_id
+ORDER BY p.plays DESC, p.artist_id
+""")
+
+level_users_select = ("""SELECT day, level, count(*) AS users
+FROM daily_user_levels
+WHERE day >= %(start)s
+AND day < %(end)s
+GROUP BY day, level
+ORDER BY day, level
+""")
+
+level_users_raw_select = ("""SELECT start_time::date AS day, level, count(DISTINCT user_id) AS users
+FROM songplays
+WHERE start_time >= %(start)s
+AND start_time < %(end)s
+AND level IS NOT NULL
+AND user_id IS NOT NULL
+GROUP BY 1, 2
+ORDER BY 1, 2
+""")
 
 # FIND SONGS
 
@@ -94,7 +440,40 @@ and a.name = %s
 and s.duration = %s
 """)
 
+# every song with its artist name, used to build the in-memory song index
+song_index_select = ("""select s.title, a.name, s.duration, s.song_id, a.artist_id
+from songs s
+inner join artists a
+on a.artist_id = s.artist_id
+""")
+
+# timestamps of a batch that are already in the time table
+time_loaded_select = "SELECT start_time FROM time WHERE start_time BETWEEN %s AND %s"
+
+# FIND INGESTED FILES
+
+ingested_files_select = "SELECT path, size, mtime, content_hash FROM ingested_files"
+
 # QUERY LISTS
 
-create_table_queries = [user_table_create, artist_table_create, song_table_create, time_table_create, songplay_table_create]
-drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
\ No newline at end of file
+create_table_queries = [user_table_create, artist_table_create, song_table_create, time_table_create, songplay_table_create, ingested_files_table_create,
+                        hourly_plays_table_create, daily_song_plays_table_create, daily_artist_plays_table_create, daily_user_levels_table_create, rollup_watermark_table_create]
+drop_table_queries = [songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, ingested_files_table_drop,
+                      hourly_plays_table_drop, daily_song_plays_table_drop, daily_artist_plays_table_drop, daily_user_levels_table_drop, rollup_watermark_table_drop]
+# secondary indexes, dropped before a full bulk load and built once after it
+create_index_queries = [song_lookup_index_create, artist_lookup_index_create, songplay_user_index_create, songplay_song_index_create]
+drop_index_queries = [song_lookup_index_drop, artist_lookup_index_drop, songplay_user_index_drop, songplay_song_index_drop]
+# (table, staging table create, merge) in load order, songs and artists must be merged before songplays
+bulk_load_queries = [('songs', songs_staging_create, song_table_merge),
+                     ('artists', artists_staging_create, artist_table_merge),
+                     ('users', users_staging_create, user_table_merge),
+                     ('time', time_staging_create, time_table_merge),
+                     ('songplays', songplays_staging_create, songplay_table_merge)]
+# new songplays first, the watermark last
+rollup_refresh_queries = [new_songplays_create, hourly_plays_merge, daily_song_plays_merge, daily_artist_plays_merge,
+                          daily_user_levels_merge, rollup_watermark_upsert]
+# the rollup query and the raw table query of every question of dashboard_queries.py
+dashboard_queries = {'plays_per_hour': (hourly_plays_select, hourly_plays_raw_select),
+                     'top_songs': (top_songs_select, top_songs_raw_select),
+                     'top_artists': (top_artists_select, top_artists_raw_select),
+                     'level_users': (level_users_select, level_users_raw_select)}
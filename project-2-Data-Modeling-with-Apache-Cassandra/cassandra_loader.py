@@ -0,0 +1,154 @@
+import argparse
+import threading
+import time
+from collections import Counter
+from cassandra import WriteTimeout
+from cassandra.cluster import OperationTimedOut
+from cql_queries import insert_table_queries, song_library_bucketed_insert
+from create_tables import connect
+from event_reader import event_files, events
+from song_buckets import bucket_of, song_library_buckets
+
+# timeouts are retried, the inserts are idempotent upserts so writing a row twice is harmless
+RETRYABLE_ERRORS = (WriteTimeout, OperationTimedOut)
+
+
+class ConcurrentLoader:
+    """Write rows with execute_async, keeping at most concurrency requests in flight.
+
+    submit blocks while the window is full, so rows are read only as fast as the cluster takes them.
+    Timed out writes are retried with exponential backoff, other errors are collected in errors.
+    """
+
+    def __init__(self, session, concurrency=128, retries=3, backoff=0.1):
+        self.session = session
+        self.retries = retries
+        self.backoff = backoff
+        self.rows = Counter()
+        self.retried = 0
+        self.errors = []
+        self._slots = threading.BoundedSemaphore(concurrency)
+        self._lock = threading.Lock()
+        self._idle = threading.Condition(self._lock)
+        self._in_flight = 0
+
+    def submit(self, table, statement, params):
+        """Write one row of a table with its prepared statement"""
+        self._slots.acquire()
+        with self._lock:
+            self._in_flight += 1
+        self._execute(table, statement, params, 0)
+
+    def _execute(self, table, statement, params, attempt):
+        try:
+            future = self.session.execute_async(statement, params)
+        except Exception as e:
+            self._on_error(e, table, statement, params, attempt)
+            return
+        future.add_callbacks(self._on_success, self._on_error, callback_args=(table,),
+                             errback_args=(table, statement, params, attempt))
+
+    def _on_success(self, result, table):
+        with self._lock:
+            self.rows[table] += 1
+        self._release()
+
+    def _on_error(self, error, table, statement, params, attempt):
+        if isinstance(error, RETRYABLE_ERRORS) and attempt < self.retries:
+            with self._lock:
+                self.retried += 1
+            # the callback runs on the driver event loop, the backoff must not sleep on it
+            timer = threading.Timer(self.backoff * 2 ** attempt, self._execute, (table, statement, params, attempt + 1))
+            timer.daemon = True
+            timer.start()
+            return
+        with self._lock:
+            self.errors.append((table, params, error))
+        self._release()
+
+    def _release(self):
+        with self._lock:
+            self._in_flight -= 1
+            if self._in_flight == 0:
+                self._idle.notify_all()
+        self._slots.release()
+
+    def wait(self):
+        """Wait until every submitted row is written or failed"""
+        with self._lock:
+            while self._in_flight:
+                self._idle.wait()
+
+
+def prepare_inserts(session, buckets=0):
+    """Prepare the INSERT of every table once, return a list of (table, prepared statement).
+
+    With buckets song_library_bucketed is loaded instead of song_library.
+    """
+    statements = []
+    for table, query in insert_table_queries:
+        if table == 'song_library' and buckets:
+            table, query = 'song_library_bucketed', song_library_bucketed_insert
+        statement = session.prepare(query)
+        statement.is_idempotent = True
+        statements.append((table, statement))
+    return statements
+
+
+# columns of every table from an event, like the inserts of the notebook
+row_builders = {
+    'session_library': lambda e: (e.session_id, e.item_in_session, e.artist, e.song_title, e.song_length),
+    'user_activity': lambda e: (e.user_id, e.session_id, e.item_in_session, e.user, e.artist, e.song_title),
+    'song_library': lambda e: (e.song_title, e.user_id, e.user),
+    'song_library_bucketed': lambda e, buckets: (e.song_title, bucket_of(e.user_id, buckets), e.user_id, e.user),
+}
+
+
+def load_tables(session, filepaths, concurrency=128, retries=3):
+    """Load the tables in a single pass over the event data, every event is fanned out to the three tables.
+
+    song_library_bucketed is loaded instead of song_library when it was created with a bucket count.
+    Reports the rows of every table and the events, time and rows/sec of the load.
+    """
+    loader = ConcurrentLoader(session, concurrency, retries)
+    buckets = song_library_buckets(session)
+    statements = prepare_inserts(session, buckets)
+    builders = dict(row_builders, song_library_bucketed=lambda e: row_builders['song_library_bucketed'](e, buckets))
+    start = time.perf_counter()
+    count = 0
+    for event in events(filepaths):
+        for table, statement in statements:
+            loader.submit(table, statement, builders[table](event))
+        count += 1
+    loader.wait()
+    seconds = time.perf_counter() - start
+
+    rows = sum(loader.rows.values())
+    stats = {'events': count, 'rows': dict(loader.rows), 'seconds': seconds,
+             'rows_per_sec': rows / seconds if seconds else 0.0,
+             'retried': loader.retried, 'failed': len(loader.errors)}
+    for table, statement in statements:
+        print('{}: {} rows'.format(table, loader.rows[table]))
+    print('{} events, {} rows in {:.2f}s, {:.0f} rows/sec'.format(count, rows, seconds, stats['rows_per_sec']))
+    print('{} timed out writes retried, {} rows failed'.format(loader.retried, len(loader.errors)))
+    for table, params, error in loader.errors[:10]:
+        print('failed {} {}: {}'.format(table, params, error))
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Load the event data into the Cassandra tables')
+    parser.add_argument('--hosts', nargs='+', default=['127.0.0.1'], help='contact points of the cluster')
+    parser.add_argument('--port', type=int, default=9042)
+    parser.add_argument('--data', default='event_data', help='directory of the event data csv files')
+    parser.add_argument('--concurrency', type=int, default=128, help='most writes in flight at a time')
+    parser.add_argument('--retries', type=int, default=3, help='retries of a timed out write')
+    args = parser.parse_args()
+
+    cluster, session = connect(args.hosts, args.port)
+    load_tables(session, event_files(args.data), args.concurrency, args.retries)
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,106 @@
+# KEYSPACE
+
+keyspace_create = ("""
+CREATE KEYSPACE IF NOT EXISTS udacity
+WITH REPLICATION =
+{ 'class' : 'SimpleStrategy', 'replication_factor' : 1 }
+""")
+
+# DROP TABLES
+
+session_library_table_drop = "drop table if exists session_library"
+user_activity_table_drop = "drop table if exists user_activity"
+song_library_table_drop = "drop table if exists song_library"
+song_library_bucketed_table_drop = "drop table if exists song_library_bucketed"
+
+# CREATE TABLES
+
+session_library_table_create = ("""
+CREATE TABLE IF NOT EXISTS session_library (
+  session_id 		int,
+  item_in_session 	int,
+  artist 			text,
+  song_title 		text,
+  song_length 		float,
+  PRIMARY KEY (session_id, item_in_session)
+)
+""")
+
+user_activity_table_create = ("""
+CREATE TABLE IF NOT EXISTS user_activity (
+  user_id 			int,
+  session_id 		int,
+  item_in_session 	int,
+  user 				text,
+  artist 			text,
+  song_title 		text,
+  PRIMARY KEY ((user_id, session_id), item_in_session)
+)
+WITH CLUSTERING ORDER BY (item_in_session asc)
+""")
+
+song_library_table_create = ("""
+CREATE TABLE IF NOT EXISTS song_library (
+  song_title 		text,
+  user_id 			int,
+  user 				text,
+  PRIMARY KEY (song_title, user_id)
+)
+""")
+
+# song_library split into buckets of users, so the listeners of a popular song are spread over
+# several partitions, the bucket count is kept in the table comment for the queries
+song_library_bucketed_table_create = ("""
+CREATE TABLE IF NOT EXISTS song_library_bucketed (
+  song_title 		text,
+  bucket 			int,
+  user_id 			int,
+  user 				text,
+  PRIMARY KEY ((song_title, bucket), user_id)
+)
+WITH comment = 'buckets={}'
+""")
+
+# INSERT RECORDS
+
+session_library_insert = ("""
+INSERT INTO session_library (session_id, item_in_session, artist, song_title, song_length)
+VALUES (?, ?, ?, ?, ?)
+""")
+
+user_activity_insert = ("""
+INSERT INTO user_activity (user_id, session_id, item_in_session, user, artist, song_title)
+VALUES (?, ?, ?, ?, ?, ?)
+""")
+
+song_library_insert = ("""
+INSERT INTO song_library (song_title, user_id, user)
+VALUES (?, ?, ?)
+""")
+
+song_library_bucketed_insert = ("""
+INSERT INTO song_library_bucketed (song_title, bucket, user_id, user)
+VALUES (?, ?, ?, ?)
+""")
+
+# QUERIES
+
+# 1. artist, song title and length of an item of a session
+session_item_select = ("SELECT artist, song_title, song_length FROM session_library "
+                       "WHERE session_id = ? AND item_in_session = ?")
+
+# 2. artist, song title and user of every item of a session of a user, ordered by item
+user_session_select = ("SELECT item_in_session, artist, song_title, user FROM user_activity "
+                       "WHERE user_id = ? AND session_id = ?")
+
+# 3. users that listened to a song
+song_listeners_select = "SELECT user_id, user FROM song_library WHERE song_title = ?"
+song_listeners_bucket_select = "SELECT user_id, user FROM song_library_bucketed WHERE song_title = ? AND bucket = ?"
+
+# QUERY LISTS
+
+create_table_queries = [session_library_table_create, user_activity_table_create, song_library_table_create]
+drop_table_queries = [session_library_table_drop, user_activity_table_drop, song_library_table_drop,
+                      song_library_bucketed_table_drop]
+insert_table_queries = [('session_library', session_library_insert), ('user_activity', user_activity_insert),
+                        ('song_library', song_library_insert)]
@@ -0,0 +1,55 @@
+import argparse
+from cassandra.cluster import Cluster, ExecutionProfile, EXEC_PROFILE_DEFAULT
+from cassandra.policies import TokenAwarePolicy, DCAwareRoundRobinPolicy
+from cql_queries import keyspace_create, create_table_queries, drop_table_queries
+from cql_queries import song_library_table_create, song_library_bucketed_table_create
+
+
+def connect(hosts=('127.0.0.1',), port=9042, request_timeout=10):
+    """Connect to the cluster with token aware routing and return (cluster, session) set to the udacity keyspace.
+
+    Token aware routing sends every statement with a routing key, prepared statements with the full
+    partition key, straight to a replica of its partition instead of through a coordinator.
+    """
+    profile = ExecutionProfile(load_balancing_policy=TokenAwarePolicy(DCAwareRoundRobinPolicy()),
+                               request_timeout=request_timeout)
+    cluster = Cluster(list(hosts), port=port, execution_profiles={EXEC_PROFILE_DEFAULT: profile})
+    session = cluster.connect()
+    session.execute(keyspace_create)
+    session.set_keyspace('udacity')
+    return cluster, session
+
+
+def drop_tables(session):
+    for query in drop_table_queries:
+        session.execute(query)
+
+
+def create_tables(session, buckets=0):
+    """Create the tables, with buckets song_library_bucketed is created instead of song_library"""
+    for query in create_table_queries:
+        if query == song_library_table_create and buckets > 1:
+            query = song_library_bucketed_table_create.format(buckets)
+        session.execute(query)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Create the udacity keyspace and its tables')
+    parser.add_argument('--hosts', nargs='+', default=['127.0.0.1'], help='contact points of the cluster')
+    parser.add_argument('--port', type=int, default=9042)
+    parser.add_argument('--keep', action='store_true', help='keep the existing tables and only create the missing ones')
+    parser.add_argument('--buckets', type=int, default=0,
+                        help='split the listeners of every song over this many song_library_bucketed partitions')
+    args = parser.parse_args()
+
+    cluster, session = connect(args.hosts, args.port)
+
+    if not args.keep:
+        drop_tables(session)
+    create_tables(session, args.buckets)
+
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,30 @@
+import csv
+import glob
+import os
+from collections import namedtuple
+
+# one event of the event data, the columns of the three tables parsed once
+Event = namedtuple('Event', ['session_id', 'item_in_session', 'artist', 'song_title', 'song_length',
+                             'user_id', 'user'])
+
+
+def event_files(filepath):
+    """List the event data csv files under a directory"""
+    return sorted(glob.glob(os.path.join(filepath, '**', '*.csv'), recursive=True))
+
+
+def events(filepaths):
+    """Yield the song play events of the event data csv files one at a time.
+
+    Rows without an artist are not song plays and are skipped, like in event_datafile_new.csv.
+    Nothing is kept in memory or written to an intermediate file.
+    """
+    for filepath in filepaths:
+        with open(filepath, encoding='utf8', newline='') as f:
+            csvreader = csv.reader(f)
+            next(csvreader)
+            for line in csvreader:
+                if line[0] == '':
+                    continue
+                yield Event(int(line[12]), int(line[4]), line[0], line[13], float(line[6]),
+                            int(line[16]), line[2] + ' ' + line[5])
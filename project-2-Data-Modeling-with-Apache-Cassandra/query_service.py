@@ -0,0 +1,144 @@
+import argparse
+import heapq
+import threading
+import time
+from collections import OrderedDict
+from cql_queries import session_item_select, user_session_select, song_listeners_select, song_listeners_bucket_select
+from create_tables import connect
+from song_buckets import song_library_buckets
+
+
+class ResultCache:
+    """LRU cache of query results whose entries expire ttl seconds after they were stored.
+
+    Counts hits and misses, an expired entry counts as a miss.
+    """
+
+    def __init__(self, maxsize=1024, ttl=60, clock=time.monotonic):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.clock = clock
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key):
+        """Return (True, result) for a live entry, (False, None) otherwise"""
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and entry[0] > self.clock():
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return True, entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return False, None
+
+    def put(self, key, result):
+        with self._lock:
+            self._entries[key] = (self.clock() + self.ttl, result)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+
+    def stats(self):
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'entries': len(self._entries)}
+
+
+class SparkifyQueries:
+    """The three query patterns of the notebook with statements prepared once.
+
+    Results are read fetch_size rows at a time, the driver fetches the next page of a large
+    partition while the rows are iterated. With cache_size the results are kept in a ResultCache
+    so repeated lookups do not reach the cluster.
+    """
+
+    def __init__(self, session, fetch_size=5000, cache_size=0, cache_ttl=60):
+        self.session = session
+        self.buckets = song_library_buckets(session)
+        self.cache = ResultCache(cache_size, cache_ttl) if cache_size else None
+        self._session_item = self._prepare(session_item_select, fetch_size)
+        self._user_session = self._prepare(user_session_select, fetch_size)
+        self._song_listeners = self._prepare(song_listeners_bucket_select if self.buckets else song_listeners_select,
+                                             fetch_size)
+
+    def _prepare(self, query, fetch_size):
+        statement = self.session.prepare(query)
+        statement.fetch_size = fetch_size
+        return statement
+
+    def _cached(self, key, query):
+        if self.cache is None:
+            return query()
+        found, result = self.cache.get(key)
+        if not found:
+            result = query()
+            self.cache.put(key, result)
+        return result
+
+    def song_in_session(self, session_id, item_in_session):
+        """Return the (artist, song_title, song_length) of an item of a session, None when there is none"""
+        def query():
+            row = self.session.execute(self._session_item, (session_id, item_in_session)).one()
+            return (row.artist, row.song_title, row.song_length) if row else None
+        return self._cached(('song_in_session', session_id, item_in_session), query)
+
+    def session_playlist(self, user_id, session_id):
+        """Return the (artist, song_title, user) of every item of a session of a user ordered by item"""
+        def query():
+            rows = self.session.execute(self._user_session, (user_id, session_id))
+            return tuple((row.artist, row.song_title, row.user) for row in rows)
+        return self._cached(('session_playlist', user_id, session_id), query)
+
+    def song_listeners(self, song_title):
+        """Return the (user_id, user) listeners of a song ordered by user_id.
+
+        With a bucketed song_library the buckets of the song are read in parallel with execute_async
+        and their rows, each ordered by user_id, are merged.
+        """
+        def query():
+            if not self.buckets:
+                rows = self.session.execute(self._song_listeners, (song_title,))
+                return tuple((row.user_id, row.user) for row in rows)
+            futures = [self.session.execute_async(self._song_listeners, (song_title, bucket))
+                       for bucket in range(self.buckets)]
+            pages = [[(row.user_id, row.user) for row in future.result()] for future in futures]
+            return tuple(heapq.merge(*pages))
+        return self._cached(('song_listeners', song_title), query)
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Answer the three questions of the notebook')
+    parser.add_argument('--hosts', nargs='+', default=['127.0.0.1'], help='contact points of the cluster')
+    parser.add_argument('--port', type=int, default=9042)
+    parser.add_argument('--fetch-size', type=int, default=5000, help='rows per page of a query')
+    parser.add_argument('--cache-size', type=int, default=0, help='cached results, no cache when 0')
+    parser.add_argument('--cache-ttl', type=float, default=60, help='seconds a cached result is used')
+    parser.add_argument('--repeat', type=int, default=1, help='times every question is asked')
+    args = parser.parse_args()
+
+    cluster, session = connect(args.hosts, args.port)
+    queries = SparkifyQueries(session, args.fetch_size, args.cache_size, args.cache_ttl)
+
+    for _ in range(args.repeat):
+        start = time.perf_counter()
+        song = queries.song_in_session(338, 4)
+        playlist = queries.session_playlist(10, 182)
+        listeners = queries.song_listeners('All Hands Against His Own')
+        print('answered in {:.1f}ms'.format((time.perf_counter() - start) * 1000))
+    print(song)
+    for item in playlist:
+        print(*item)
+    for user_id, user in listeners:
+        print(user)
+    if queries.cache is not None:
+        print('cache: {hits} hits, {misses} misses, {entries} entries'.format(**queries.cache.stats()))
+
+    cluster.shutdown()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import argparse
+import re
+from collections import defaultdict
+from event_reader import event_files, events
+
+# bytes of a song_library row besides its song title and user name, the user_id, bucket and cell overhead
+ROW_OVERHEAD = 24
+
+
+def bucket_of(user_id, buckets):
+    """Bucket of a listener in song_library_bucketed, a user always lands in the same bucket of a song"""
+    return user_id % buckets
+
+
+def song_library_buckets(session):
+    """Bucket count of song_library_bucketed from its table comment, 0 when the table does not exist"""
+    table = session.cluster.metadata.keyspaces[session.keyspace].tables.get('song_library_bucketed')
+    if table is None:
+        return 0
+    match = re.search(r'buckets=(\d+)', table.options.get('comment') or '')
+    return int(match.group(1)) if match else 0
+
+
+def song_listener_names(event_iter):
+    """Return the {user_id: user} listeners of every song title of the events, the rows of song_library"""
+    listeners = defaultdict(dict)
+    for event in event_iter:
+        listeners[event.song_title][event.user_id] = event.user
+    return listeners
+
+
+def partition_sizes(listeners, buckets):
+    """Return the [rows, estimated bytes] of every song_library partition for a bucket count"""
+    sizes = defaultdict(lambda: [0, 0])
+    for song_title, users in listeners.items():
+        title_bytes = len(song_title.encode('utf8'))
+        for user_id, user in users.items():
+            size = sizes[(song_title, bucket_of(user_id, buckets) if buckets > 1 else 0)]
+            size[0] += 1
+            size[1] += title_bytes + len(user.encode('utf8')) + ROW_OVERHEAD
+    return list(sizes.values())
+
+
+def percentile(values, fraction):
+    """Value at a fraction of sorted values"""
+    return values[min(len(values) - 1, int(len(values) * fraction))] if values else 0
+
+
+def partition_report(filepaths, bucket_counts, max_partition_bytes):
+    """Print the partition size distribution of song_library for every bucket count and suggest one.
+
+    The suggested bucket count is the smallest one whose largest partition fits in max_partition_bytes.
+    """
+    print('{:>8} {:>11} {:>9} {:>9} {:>9} {:>12} {:>12}'.format(
+        'buckets', 'partitions', 'rows p50', 'rows p99', 'rows max', 'bytes p99', 'bytes max'))
+    listeners = song_listener_names(events(filepaths))
+    report = []
+    for buckets in bucket_counts:
+        sizes = partition_sizes(listeners, buckets)
+        rows = sorted(s[0] for s in sizes)
+        size_bytes = sorted(s[1] for s in sizes)
+        report.append({'buckets': buckets, 'partitions': len(sizes),
+                       'rows_p50': percentile(rows, 0.5), 'rows_p99': percentile(rows, 0.99),
+                       'rows_max': rows[-1] if rows else 0,
+                       'bytes_p99': percentile(size_bytes, 0.99), 'bytes_max': size_bytes[-1] if size_bytes else 0})
+        print('{buckets:>8} {partitions:>11} {rows_p50:>9} {rows_p99:>9} {rows_max:>9} '
+              '{bytes_p99:>12} {bytes_max:>12}'.format(**report[-1]))
+
+    fitting = [r['buckets'] for r in report if r['bytes_max'] <= max_partition_bytes]
+    if fitting:
+        print('{} buckets keep every partition under {} bytes'.format(min(fitting), max_partition_bytes))
+    else:
+        print('no bucket count keeps every partition under {} bytes'.format(max_partition_bytes))
+    return report
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Report the song_library partition sizes of the event data '
+                                                 'for several bucket counts')
+    parser.add_argument('--data', default='event_data', help='directory of the event data csv files')
+    parser.add_argument('--buckets', type=int, nargs='+', default=[1, 2, 4, 8, 16, 32],
+                        help='bucket counts to report')
+    parser.add_argument('--max-partition-mb', type=float, default=10,
+                        help='largest wanted partition, the suggested bucket count keeps every partition under it')
+    args = parser.parse_args()
+
+    partition_report(event_files(args.data), args.buckets, int(args.max_partition_mb * 1024 * 1024))
+
+
+if __name__ == "__main__":
+    main()
@@ -1,6 +1,42 @@
+import argparse
 import configparser
+import re
 import psycopg2
-from sql_queries import create_table_queries, drop_table_queries
+from sql_queries import create_table_queries, drop_table_queries, insert_table_queries
+from sql_queries import table_designs, column_encodings, plan_redistribution_steps
+from staging_loader import postgres_sql
+
+COLUMN_PATTERN = re.compile(r'^(\s*)(\w+)(\s+)(\w+)(.*?)(,?)\s*$')
+CONSTRAINT_PATTERN = re.compile(r'\s+(not null|null|primary key)\b', re.IGNORECASE)
+
+
+def apply_table_design(query):
+    """Add the column encodings, distribution style and sort key of the table design to a CREATE TABLE statement"""
+    table = re.search(r'create table if not exists (\w+)', query, re.IGNORECASE).group(1)
+    design = table_designs.get(table)
+    if design is None:
+        return query
+
+    raw_column = design['sortkey'][0].lower() if design.get('sortkey') else None
+    lines = []
+    for line in query.split('\n'):
+        match = COLUMN_PATTERN.match(line)
+        if match and match.group(2).lower() != 'create':
+            indent, column, space, data_type, rest, comma = match.groups()
+            encoding = 'raw' if column.lower() == raw_column else column_encodings.get(data_type.lower(), 'raw')
+            # ENCODE goes after the type and identity and before the column constraints
+            constraint = CONSTRAINT_PATTERN.search(rest)
+            at = constraint.start() if constraint else len(rest)
+            line = '{}{}{}{}{} ENCODE {}{}{}'.format(indent, column, space, data_type, rest[:at], encoding, rest[at:], comma)
+        lines.append(line)
+    query = '\n'.join(lines)
+
+    attributes = 'diststyle {}'.format(design['diststyle'])
+    if design.get('distkey'):
+        attributes += ' distkey({})'.format(design['distkey'])
+    if design.get('sortkey'):
+        attributes += ' compound sortkey({})'.format(', '.join(design['sortkey']))
+    return re.sub(r'\)\s*;\s*$', ')\n{};\n'.format(attributes), query)
 
 
 def drop_tables(cur, conn):
@@ -10,22 +46,47 @@ def drop_tables(cur, conn):
         conn.commit()
 
 
-def create_tables(cur, conn):
-    """Create tables if they don't already exist on the Redshift Database"""
+def create_tables(cur, conn, target='redshift'):
+    """Create tables if they don't already exist on the Redshift Database, or on the local PostgreSQL stand-in"""
     for query in create_table_queries:
-        cur.execute(query)
+        cur.execute(apply_table_design(query) if target == 'redshift' else postgres_sql(query))
         conn.commit()
 
 
+def check_query_plans(cur):
+    """EXPLAIN the insert queries and flag the steps that broadcast or redistribute both sides of a join"""
+    flagged = []
+    for query in insert_table_queries:
+        table = re.search(r'insert into (\w+)', query, re.IGNORECASE).group(1)
+        cur.execute('EXPLAIN ' + query)
+        for (step,) in cur.fetchall():
+            if any(redistribution in step for redistribution in plan_redistribution_steps):
+                flagged.append((table, step.strip()))
+                print('{}: {}'.format(table, step.strip()))
+    if not flagged:
+        print('no broadcast or redistribute both steps in the insert queries')
+    return flagged
+
+
 def main():
+    parser = argparse.ArgumentParser(description='Create the staging and analytical tables')
+    parser.add_argument('--target', choices=['redshift', 'postgres'], default='redshift',
+                        help='postgres creates the tables on the local PostgreSQL stand-in in [POSTGRES]')
+    parser.add_argument('--explain', action='store_true',
+                        help='flag the broadcast and redistribute both steps in the plans of the insert queries')
+    args = parser.parse_args()
+
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    section = 'CLUSTER' if args.target == 'redshift' else 'POSTGRES'
+    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config[section].values()))
     cur = conn.cursor()
 
     drop_tables(cur, conn)
-    create_tables(cur, conn)
+    create_tables(cur, conn, args.target)
+    if args.explain and args.target == 'redshift':
+        check_query_plans(cur)
 
     conn.close()
 
@@ -0,0 +1,23 @@
+import configparser
+import psycopg2
+import sql_queries
+from dashboard import argument_parser, print_answers
+
+
+def main():
+    parser = argument_parser()
+    parser.add_argument('--target', choices=['redshift', 'postgres'], default='redshift',
+                        help='postgres queries the local PostgreSQL stand-in in [POSTGRES]')
+    args = parser.parse_args()
+
+    config = configparser.ConfigParser()
+    config.read('dwh.cfg')
+
+    section = 'CLUSTER' if args.target == 'redshift' else 'POSTGRES'
+    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config[section].values()))
+    print_answers(conn.cursor(), sql_queries, args)
+    conn.close()
+
+
+if __name__ == "__main__":
+    main()
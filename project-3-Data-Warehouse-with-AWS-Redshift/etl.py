@@ -1,33 +1,76 @@
+import argparse
 import configparser
 import psycopg2
-from sql_queries import copy_table_queries, insert_table_queries
+from sql_queries import copy_table_queries, insert_table_queries, merge_table_queries, staging_truncate_queries
+from sql_queries import load_watermark_seed_queries, rollups_watermark_queries
+from staging_loader import load_staging_tables_sliced, postgres_sql
+from instrumentation import metrics
 
 
 def load_staging_tables(cur, conn):
     """Load events and song data from S3 into staging tables using the copy command"""
     for query in copy_table_queries:
-        cur.execute(query)
-        conn.commit()
+        metrics.execute(cur, query, conn=conn)
 
 
-def insert_tables(cur, conn):
-    """Insert data into analytical tables from staging tables"""
+def insert_tables(cur, conn, target='redshift'):
+    """Insert data into analytical tables and the rollups from staging tables and set the load and rollups watermarks to
+    the newest staged event, all in one transaction so a failed load leaves neither the rows nor the watermark behind"""
     for query in insert_table_queries:
-        cur.execute(query)
-        conn.commit()
+        metrics.execute(cur, query if target == 'redshift' else postgres_sql(query))
+    for query in load_watermark_seed_queries + rollups_watermark_queries:
+        metrics.execute(cur, query)
+    conn.commit()
+
+
+def merge_tables(cur, conn, target='redshift'):
+    """Merge the staging events newer than the load watermark into the analytical tables in one transaction"""
+    for query in merge_table_queries:
+        metrics.execute(cur, query if target == 'redshift' else postgres_sql(query))
+    conn.commit()
+
+
+def truncate_staging_tables(cur, conn):
+    """Empty the staging tables before an incremental load"""
+    for query in staging_truncate_queries:
+        metrics.execute(cur, query, conn=conn)
 
 
 def main():
+    parser = argparse.ArgumentParser(description='Load the staging and analytical tables')
+    parser.add_argument('--sliced', action='store_true',
+                        help='load the staging tables with slice aligned COPY manifests')
+    parser.add_argument('--target', choices=['redshift', 'postgres'], default='redshift',
+                        help='postgres runs the sliced load against the local PostgreSQL stand-in in [POSTGRES]')
+    parser.add_argument('--incremental', action='store_true',
+                        help='merge only the staging events newer than the load watermark into the analytical tables')
+    parser.add_argument('--metrics-log', help='file of the json stage logs, stderr when not given')
+    parser.add_argument('--prometheus-file', help='write the stage totals to this Prometheus text file')
+    args = parser.parse_args()
+    metrics.configure('p3_etl', args.metrics_log, args.prometheus_file)
+
     config = configparser.ConfigParser()
     config.read('dwh.cfg')
 
-    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config['CLUSTER'].values()))
+    section = 'CLUSTER' if args.target == 'redshift' else 'POSTGRES'
+    conn = psycopg2.connect("host={} dbname={} user={} password={} port={}".format(*config[section].values()))
     cur = conn.cursor()
     
-    load_staging_tables(cur, conn)
-    insert_tables(cur, conn)
+    if args.incremental:
+        truncate_staging_tables(cur, conn)
+    with metrics.stage('load_staging_tables', target=args.target):
+        if args.sliced or args.target != 'redshift':
+            load_staging_tables_sliced(cur, conn, config, args.target)
+        else:
+            load_staging_tables(cur, conn)
+    with metrics.stage('insert_tables', target=args.target):
+        if args.incremental:
+            merge_tables(cur, conn, args.target)
+        else:
+            insert_tables(cur, conn, args.target)
 
     conn.close()
+    metrics.write_prometheus()
 
 
 if __name__ == "__main__":
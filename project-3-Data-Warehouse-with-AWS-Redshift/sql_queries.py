@@ -5,6 +5,10 @@ import configparser
 config = configparser.ConfigParser()
 config.read('dwh.cfg')
 
+LOG_DATA = config.get('S3', 'LOG_DATA', fallback='s3://udacity-dend/log_data')
+LOG_JSONPATH = config.get('S3', 'LOG_JSONPATH', fallback='s3://udacity-dend/log_json_path.json')
+SONG_DATA = config.get('S3', 'SONG_DATA', fallback='s3://udacity-dend/song_data')
+
 # DROP TABLES
 
 staging_events_table_drop = "DROP TABLE IF EXISTS staging_events;"
@@ -14,6 +18,11 @@ user_table_drop = "DROP TABLE IF EXISTS users;"
 song_table_drop = "DROP TABLE IF EXISTS song;"
 artist_table_drop = "DROP TABLE IF EXISTS artist;"
 time_table_drop = "DROP TABLE IF EXISTS time;"
+load_watermark_table_drop = "DROP TABLE IF EXISTS load_watermark;"
+hourly_plays_table_drop = "DROP TABLE IF EXISTS hourly_plays;"
+daily_song_plays_table_drop = "DROP TABLE IF EXISTS daily_song_plays;"
+daily_artist_plays_table_drop = "DROP TABLE IF EXISTS daily_artist_plays;"
+daily_user_levels_table_drop = "DROP TABLE IF EXISTS daily_user_levels;"
 
 # CREATE TABLES
 
@@ -113,22 +122,100 @@ CREATE TABLE if not exists time (
 );
 """)
 
+load_watermark_table_create = ("""
+CREATE TABLE if not exists load_watermark (
+  source 	varchar(64) not null PRIMARY KEY,
+  max_ts 	bigint not null
+);
+""")
+
+# ROLLUP TABLES
+# aggregates of songplay for the dashboard queries of dashboard_queries.py, built by insert_tables and merged with the
+# new songplays of every incremental load. daily_user_levels is the distinct set of users per day and level, so the
+# free and paid users of a day are counted from it without counting distinct over songplay. Redshift does not enforce
+# keys, the merges below keep one row per hour, (day, song_id), (day, artist_id) and (day, level, user_id)
+
+hourly_plays_table_create = ("""
+CREATE TABLE if not exists hourly_plays (
+  hour      	timestamp not null,
+  plays     	bigint not null
+);
+""")
+
+daily_song_plays_table_create = ("""
+CREATE TABLE if not exists daily_song_plays (
+  day       	date not null,
+  song_id   	varchar(256) not null,
+  plays     	bigint not null
+);
+""")
+
+daily_artist_plays_table_create = ("""
+CREATE TABLE if not exists daily_artist_plays (
+  day       	date not null,
+  artist_id 	varchar(256) not null,
+  plays     	bigint not null
+);
+""")
+
+daily_user_levels_table_create = ("""
+CREATE TABLE if not exists daily_user_levels (
+  day       	date not null,
+  level     	varchar(256) not null,
+  user_id   	int not null
+);
+""")
+
 # STAGING TABLES
 
 staging_events_copy = ("""
-    copy staging_events from 's3://udacity-dend/log_data'
+    copy staging_events from '{}'
     credentials 'aws_iam_role={}'
     region 'us-west-2' compupdate off
-    JSON 's3://udacity-dend/log_json_path.json';
-""").format(config.get('IAM_ROLE', 'ARN'))
+    JSON '{}';
+""").format(LOG_DATA, config.get('IAM_ROLE', 'ARN'), LOG_JSONPATH)
 
 staging_songs_copy = ("""
-    copy staging_songs from 's3://udacity-dend/song_data'
+    copy staging_songs from '{}'
     credentials 'aws_iam_role={}'
     region 'us-west-2' compupdate off
     JSON 'auto' truncatecolumns;
+""").format(SONG_DATA, config.get('IAM_ROLE', 'ARN'))
+
+# SLICED STAGING TABLES
+# the same copies as above, loading the files listed in a manifest, the manifest url is filled in per chunk
+
+staging_events_copy_manifest = ("""
+    copy staging_events from '{{}}'
+    credentials 'aws_iam_role={}'
+    region 'us-west-2' compupdate off
+    JSON '{}'
+    manifest;
+""").format(config.get('IAM_ROLE', 'ARN'), LOG_JSONPATH)
+
+staging_songs_copy_manifest = ("""
+    copy staging_songs from '{{}}'
+    credentials 'aws_iam_role={}'
+    region 'us-west-2' compupdate off
+    JSON 'auto' truncatecolumns
+    manifest;
 """).format(config.get('IAM_ROLE', 'ARN'))
 
+cluster_slices_select = ("""
+select  count(distinct node),
+        count(*)
+    from stv_slices ;
+""")
+
+load_commits_select = ("""
+select  count(distinct filename),
+        sum(lines_scanned),
+        min(curtime),
+        max(curtime)
+    from stl_load_commits
+    where query = pg_last_copy_id() ;
+""")
+
 # FINAL TABLES
 
 songplay_table_insert = ("""
@@ -160,6 +247,7 @@ select  distinct
     where se.page = 'NextSong' ;
 """)
 
+# a single pass over staging_events that keeps the most recent record of every user, ts ties keep one row
 user_table_insert = ("""
 insert into users
 (
@@ -169,20 +257,22 @@ insert into users
     gender,
     level
 )
-select 	s1.userId,
-		s1.firstname,
-        s1.lastname,
-        s1.gender,
-        s1.level
-	from staging_events s1
-	inner join (
-      select  userId,
-              MAX(TIMESTAMP 'epoch' + ts/1000 * interval '1 second') as most_recent_time
+select 	user_id,
+		first_name,
+        last_name,
+        gender,
+        level
+	from (
+      select  userId as user_id,
+              firstName as first_name,
+              lastName as last_name,
+              gender,
+              level,
+              ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) as recency
           from staging_events
-          group by userId
-	) s2
-    	on  s2.userId = s1.userId
-        and s2.most_recent_time = TIMESTAMP 'epoch' + s1.ts/1000 * interval '1 second' ;
+          where userId is not null
+    ) latest
+    where recency = 1 ;
 """)
 
 song_table_insert = ("""
@@ -243,9 +333,574 @@ select 	distinct
 	from songplay ;
 """)
 
+hourly_plays_insert = ("""
+insert into hourly_plays (hour, plays)
+select  date_trunc('hour', start_time),
+        count(*)
+    from songplay
+    group by 1 ;
+""")
+
+daily_song_plays_insert = ("""
+insert into daily_song_plays (day, song_id, plays)
+select  start_time::date,
+        song_id,
+        count(*)
+    from songplay
+    group by 1, 2 ;
+""")
+
+daily_artist_plays_insert = ("""
+insert into daily_artist_plays (day, artist_id, plays)
+select  start_time::date,
+        artist_id,
+        count(*)
+    from songplay
+    group by 1, 2 ;
+""")
+
+daily_user_levels_insert = ("""
+insert into daily_user_levels (day, level, user_id)
+select  distinct
+        start_time::date,
+        level,
+        user_id
+    from songplay ;
+""")
+
+# INCREMENTAL MERGE
+# only the staging events newer than the load_watermark are merged. Dimensions use the delete+insert merge pattern
+# through a temp stage table, time is derived from the new songplays only and the watermark moves in the same transaction.
+
+staging_events_truncate = "TRUNCATE staging_events;"
+staging_songs_truncate = "TRUNCATE staging_songs;"
+
+new_events_drop = "DROP TABLE IF EXISTS new_events;"
+new_songplays_drop = "DROP TABLE IF EXISTS new_songplays;"
+hourly_plays_stage_drop = "DROP TABLE IF EXISTS hourly_plays_stage;"
+daily_song_plays_stage_drop = "DROP TABLE IF EXISTS daily_song_plays_stage;"
+daily_artist_plays_stage_drop = "DROP TABLE IF EXISTS daily_artist_plays_stage;"
+users_stage_drop = "DROP TABLE IF EXISTS users_stage;"
+song_stage_drop = "DROP TABLE IF EXISTS song_stage;"
+artist_stage_drop = "DROP TABLE IF EXISTS artist_stage;"
+
+new_events_create = ("""
+create temp table new_events as
+select  *
+    from staging_events
+    where ts > (
+      select  coalesce(max(max_ts), 0)
+          from load_watermark
+          where source = 'staging_events'
+    ) ;
+""")
+
+# the songplays of the new events are kept in a temp table, the rollups are merged from it below
+new_songplays_create = ("""
+create temp table new_songplays as
+select  distinct 
+        TIMESTAMP 'epoch' + se.ts/1000 * interval '1 second' as start_time,
+        se.userId as user_id,
+        se.level,
+        ss.song_id,
+        ss.artist_id,
+   		se.sessionId as session_id,
+        se.location,
+        se.useragent as user_agent
+   	from new_events se
+    inner join staging_songs ss
+    	on 	ss.artist_name = se.artist
+        and ss.title = se.song
+        and ss.duration = se.length
+    where se.page = 'NextSong' ;
+""")
+
+songplay_table_merge = ("""
+insert into songplay
+(
+    start_time,
+  	user_id,
+  	level,
+  	song_id,
+  	artist_id,
+  	session_id,
+  	location,
+  	user_agent
+)
+select  start_time,
+        user_id,
+        level,
+        song_id,
+        artist_id,
+        session_id,
+        location,
+        user_agent
+   	from new_songplays ;
+""")
+
+# the most recent record of every user in the new events, it replaces the stored user so the level stays current
+users_stage_create = ("""
+create temp table users_stage as
+select 	user_id,
+		first_name,
+        last_name,
+        gender,
+        level
+	from (
+      select  userId as user_id,
+              firstName as first_name,
+              lastName as last_name,
+              gender,
+              level,
+              ROW_NUMBER() OVER (PARTITION BY userId ORDER BY ts DESC) as recency
+          from new_events
+          where userId is not null
+    ) latest
+    where recency = 1 ;
+""")
+
+users_stage_delete = ("""
+delete from users
+    using users_stage
+    where users.user_id = users_stage.user_id ;
+""")
+
+users_stage_insert = ("""
+insert into users (user_id, first_name, last_name, gender, level)
+select  user_id, first_name, last_name, gender, level
+    from users_stage ;
+""")
+
+song_stage_create = ("""
+create temp table song_stage as
+select  distinct 
+        song_id,
+        title,
+        artist_id,
+        songYear as year,
+        duration
+    from staging_songs
+    where song_id is not null ;
+""")
+
+song_stage_delete = ("""
+delete from song
+    using song_stage
+    where song.song_id = song_stage.song_id ;
+""")
+
+song_stage_insert = ("""
+insert into song (song_id, title, artist_id, year, duration)
+select  song_id, title, artist_id, year, duration
+    from song_stage ;
+""")
+
+artist_stage_create = ("""
+create temp table artist_stage as
+select  artist_id,
+        name,
+        location,
+        latitude,
+        longitude
+    from (
+      select  artist_id,
+              artist_name as name,
+              artist_location as location,
+              artist_latitude as latitude,
+              artist_longitude as longitude,
+              ROW_NUMBER() OVER (PARTITION BY artist_id ORDER BY artist_name) as pick
+          from staging_songs
+          where artist_id is not null
+    ) artists
+    where pick = 1 ;
+""")
+
+artist_stage_delete = ("""
+delete from artist
+    using artist_stage
+    where artist.artist_id = artist_stage.artist_id ;
+""")
+
+artist_stage_insert = ("""
+insert into artist (artist_id, name, location, latitude, longitude)
+select  artist_id, name, location, latitude, longitude
+    from artist_stage ;
+""")
+
+# the timestamps of the new songplays that are not in time yet, songplay itself is not scanned
+time_table_merge = ("""
+insert into time
+(
+    start_time,
+    hour,
+    day,
+    week,
+    month,
+    t_year,
+    weekday
+)
+select 	distinct 
+		n.start_time,
+        EXTRACT(hour from n.start_time),
+        EXTRACT(day from n.start_time),
+        EXTRACT(week from n.start_time),
+        EXTRACT(month from n.start_time),
+        EXTRACT(year from n.start_time),
+        EXTRACT(weekday from n.start_time)
+	from new_songplays n
+    left join time t
+        on t.start_time = n.start_time
+    where t.start_time is null ;
+""")
+
+# ROLLUP MERGE
+# the plays of the new songplays are added to the stored rows of the same hour or day through a stage table that
+# replaces them with delete+insert, new users of a day and level are inserted when they are not there yet
+
+hourly_plays_stage_create = ("""
+create temp table hourly_plays_stage as
+select  hour,
+        sum(plays) as plays
+    from (
+      select  hour,
+              plays
+          from hourly_plays
+          where hour in (select distinct date_trunc('hour', start_time) from new_songplays)
+      union all
+      select  date_trunc('hour', start_time),
+              count(*)
+          from new_songplays
+          group by 1
+    ) merged
+    group by hour ;
+""")
+
+hourly_plays_stage_delete = ("""
+delete from hourly_plays
+    using hourly_plays_stage
+    where hourly_plays.hour = hourly_plays_stage.hour ;
+""")
+
+hourly_plays_stage_insert = ("""
+insert into hourly_plays (hour, plays)
+select  hour, plays
+    from hourly_plays_stage ;
+""")
+
+daily_song_plays_stage_create = ("""
+create temp table daily_song_plays_stage as
+select  day,
+        song_id,
+        sum(plays) as plays
+    from (
+      select  d.day,
+              d.song_id,
+              d.plays
+          from daily_song_plays d
+          inner join (select distinct start_time::date as day, song_id from new_songplays) n
+              on  n.day = d.day
+              and n.song_id = d.song_id
+      union all
+      select  start_time::date,
+              song_id,
+              count(*)
+          from new_songplays
+          group by 1, 2
+    ) merged
+    group by day, song_id ;
+""")
+
+daily_song_plays_stage_delete = ("""
+delete from daily_song_plays
+    using daily_song_plays_stage
+    where daily_song_plays.day = daily_song_plays_stage.day
+    and daily_song_plays.song_id = daily_song_plays_stage.song_id ;
+""")
+
+daily_song_plays_stage_insert = ("""
+insert into daily_song_plays (day, song_id, plays)
+select  day, song_id, plays
+    from daily_song_plays_stage ;
+""")
+
+daily_artist_plays_stage_create = ("""
+create temp table daily_artist_plays_stage as
+select  day,
+        artist_id,
+        sum(plays) as plays
+    from (
+      select  d.day,
+              d.artist_id,
+              d.plays
+          from daily_artist_plays d
+          inner join (select distinct start_time::date as day, artist_id from new_songplays) n
+              on  n.day = d.day
+              and n.artist_id = d.artist_id
+      union all
+      select  start_time::date,
+              artist_id,
+              count(*)
+          from new_songplays
+          group by 1, 2
+    ) merged
+    group by day, artist_id ;
+""")
+
+daily_artist_plays_stage_delete = ("""
+delete from daily_artist_plays
+    using daily_artist_plays_stage
+    where daily_artist_plays.day = daily_artist_plays_stage.day
+    and daily_artist_plays.artist_id = daily_artist_plays_stage.artist_id ;
+""")
+
+daily_artist_plays_stage_insert = ("""
+insert into daily_artist_plays (day, artist_id, plays)
+select  day, artist_id, plays
+    from daily_artist_plays_stage ;
+""")
+
+daily_user_levels_merge = ("""
+insert into daily_user_levels (day, level, user_id)
+select  distinct
+        n.start_time::date,
+        n.level,
+        n.user_id
+    from new_songplays n
+    left join daily_user_levels d
+        on  d.day = n.start_time::date
+        and d.level = n.level
+        and d.user_id = n.user_id
+    where d.user_id is null ;
+""")
+
+# DASHBOARD QUERIES
+# every question as a query on the rollups and the same query on the raw tables, both take the [start, end) range
+# and return the same rows. The rollups answer only when their watermark is the load watermark of songplay, two
+# single row lookups instead of counting songplay
+
+rollups_current_select = ("""
+select  coalesce((select max(max_ts) from load_watermark where source = 'rollups'), -1)
+        = coalesce((select max(max_ts) from load_watermark where source = 'staging_events'), -1) ;
+""")
+
+# first and last songplay, the default range of the questions
+songplays_range_select = "select min(start_time), max(start_time) from songplay ;"
+
+hourly_plays_select = ("""
+select  hour,
+        plays
+    from hourly_plays
+    where hour >= %(start)s
+    and hour < %(end)s
+    order by hour ;
+""")
+
+hourly_plays_raw_select = ("""
+select  date_trunc('hour', start_time) as hour,
+        count(*) as plays
+    from songplay
+    where start_time >= %(start)s
+    and start_time < %(end)s
+    group by 1
+    order by 1 ;
+""")
+
+top_songs_select = ("""
+select  p.song_id,
+        s.title,
+        p.plays
+    from (
+      select  song_id,
+              sum(plays)::bigint as plays
+          from daily_song_plays
+          where day >= %(start)s
+          and day < %(end)s
+          group by song_id
+          order by plays desc, song_id
+          limit %(limit)s
+    ) p
+    left join song s
+        on s.song_id = p.song_id
+    order by p.plays desc, p.song_id ;
+""")
+
+top_songs_raw_select = ("""
+select  p.song_id,
+        s.title,
+        p.plays
+    from (
+      select  song_id,
+              count(*) as plays
+          from songplay
+          where start_time >= %(start)s
+          and start_time < %(end)s
+          group by song_id
+          order by plays desc, song_id
+          limit %(limit)s
+    ) p
+    left join song s
+        on s.song_id = p.song_id
+    order by p.plays desc, p.song_id ;
+""")
+
+top_artists_select = ("""
+select  p.artist_id,
+        a.name,
+        p.plays
+    from (
+      select  artist_id,
+              sum(plays)::bigint as plays
+          from daily_artist_plays
+          where day >= %(start)s
+          and day < %(end)s
+          group by artist_id
+          order by plays desc, artist_id
+          limit %(limit)s
+    ) p
+    left join artist a
+        on a.artist_id = p.artist_id
+    order by p.plays desc, p.artist_id ;
+""")
+
+top_artists_raw_select = ("""
+select  p.artist_id,
+        a.name,
+        p.plays
+    from (
+      select  artist_id,
+              count(*) as plays
+          from songplay
+          where start_time >= %(start)s
+          and start_time < %(end)s
+          group by artist_id
+          order by plays desc, artist_id
+          limit %(limit)s
+    ) p
+    left join artist a
+        on a.artist_id = p.artist_id
+    order by p.plays desc, p.artist_id ;
+""")
+
+level_users_select = ("""
+select  day,
+        level,
+        count(*) as users
+    from daily_user_levels
+    where day >= %(start)s
+    and day < %(end)s
+    group by day, level
+    order by day, level ;
+""")
+
+level_users_raw_select = ("""
+select  start_time::date as day,
+        level,
+        count(distinct user_id) as users
+    from songplay
+    where start_time >= %(start)s
+    and start_time < %(end)s
+    group by 1, 2
+    order by 1, 2 ;
+""")
+
+load_watermark_delete = ("""
+delete from load_watermark
+    where source = 'staging_events'
+    and exists (select 1 from new_events) ;
+""")
+
+load_watermark_insert = ("""
+insert into load_watermark (source, max_ts)
+select  'staging_events',
+        max(ts)
+    from new_events
+    having count(*) > 0 ;
+""")
+
+# the full load sets the watermark to the newest staged event, so the next incremental load only merges newer events
+load_watermark_seed_delete = ("""
+delete from load_watermark
+    where source = 'staging_events'
+    and exists (select 1 from staging_events) ;
+""")
+
+load_watermark_seed_insert = ("""
+insert into load_watermark (source, max_ts)
+select  'staging_events',
+        max(ts)
+    from staging_events
+    having count(*) > 0 ;
+""")
+
+# the rollups record the load watermark they were built or merged up to, in the transaction of the load
+rollups_watermark_delete = "delete from load_watermark where source = 'rollups' ;"
+
+rollups_watermark_insert = ("""
+insert into load_watermark (source, max_ts)
+select  'rollups',
+        max_ts
+    from load_watermark
+    where source = 'staging_events' ;
+""")
+
+# TABLE DESIGN
+# distribution style, distribution key and compound sort key of every table, added to the CREATE statements by create_tables.py.
+# The staging tables are distributed on the song title the songplay insert joins them on, songplay and song on song_id
+# and the small users and artist dimensions are copied to every node.
+
+table_designs = {
+    'staging_events': {'diststyle': 'key', 'distkey': 'song', 'sortkey': ['ts']},
+    'staging_songs': {'diststyle': 'key', 'distkey': 'title', 'sortkey': ['title']},
+    'songplay': {'diststyle': 'key', 'distkey': 'song_id', 'sortkey': ['start_time', 'user_id']},
+    'users': {'diststyle': 'all', 'sortkey': ['user_id']},
+    'song': {'diststyle': 'key', 'distkey': 'song_id', 'sortkey': ['song_id']},
+    'artist': {'diststyle': 'all', 'sortkey': ['artist_id']},
+    'time': {'diststyle': 'key', 'distkey': 'start_time', 'sortkey': ['start_time']},
+    'load_watermark': {'diststyle': 'all'},
+    'hourly_plays': {'diststyle': 'all', 'sortkey': ['hour']},
+    'daily_song_plays': {'diststyle': 'key', 'distkey': 'song_id', 'sortkey': ['day', 'song_id']},
+    'daily_artist_plays': {'diststyle': 'key', 'distkey': 'artist_id', 'sortkey': ['day', 'artist_id']},
+    'daily_user_levels': {'diststyle': 'key', 'distkey': 'user_id', 'sortkey': ['day', 'level']},
+}
+
+# column encodings by data type, the leading sort key column of every table is left raw
+column_encodings = {'varchar': 'zstd', 'bigint': 'az64', 'int': 'az64', 'integer': 'az64',
+                    'timestamp': 'az64', 'date': 'az64', 'double': 'zstd'}
+
+# query plan steps that broadcast a join input or redistribute both of its inputs
+plan_redistribution_steps = ['DS_BCAST_INNER', 'DS_DIST_BOTH']
+
 # QUERY LISTS
 
-create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create]
-drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop]
+create_table_queries = [staging_events_table_create, staging_songs_table_create, songplay_table_create, user_table_create, song_table_create, artist_table_create, time_table_create, load_watermark_table_create,
+                        hourly_plays_table_create, daily_song_plays_table_create, daily_artist_plays_table_create, daily_user_levels_table_create]
+drop_table_queries = [staging_events_table_drop, staging_songs_table_drop, songplay_table_drop, user_table_drop, song_table_drop, artist_table_drop, time_table_drop, load_watermark_table_drop,
+                      hourly_plays_table_drop, daily_song_plays_table_drop, daily_artist_plays_table_drop, daily_user_levels_table_drop]
 copy_table_queries = [staging_events_copy, staging_songs_copy]
-insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert]
+# (staging table, input data, manifest copy) for the sliced staging load
+sliced_copy_table_queries = [('staging_events', LOG_DATA, staging_events_copy_manifest),
+                             ('staging_songs', SONG_DATA, staging_songs_copy_manifest)]
+# the rollups are built from songplay after it is loaded
+insert_table_queries = [songplay_table_insert, user_table_insert, song_table_insert, artist_table_insert, time_table_insert,
+                        hourly_plays_insert, daily_song_plays_insert, daily_artist_plays_insert, daily_user_levels_insert]
+# run by insert_tables after the inserts and committed with them
+load_watermark_seed_queries = [load_watermark_seed_delete, load_watermark_seed_insert]
+# copy the load watermark to the rollups, last in the transaction of the full insert and of the merge
+rollups_watermark_queries = [rollups_watermark_delete, rollups_watermark_insert]
+staging_truncate_queries = [staging_events_truncate, staging_songs_truncate]
+merge_table_queries = [new_events_drop, new_songplays_drop, users_stage_drop, song_stage_drop, artist_stage_drop,
+                       hourly_plays_stage_drop, daily_song_plays_stage_drop, daily_artist_plays_stage_drop, new_events_create,
+                       new_songplays_create, songplay_table_merge,
+                       users_stage_create, users_stage_delete, users_stage_insert,
+                       song_stage_create, song_stage_delete, song_stage_insert,
+                       artist_stage_create, artist_stage_delete, artist_stage_insert,
+                       time_table_merge,
+                       hourly_plays_stage_create, hourly_plays_stage_delete, hourly_plays_stage_insert,
+                       daily_song_plays_stage_create, daily_song_plays_stage_delete, daily_song_plays_stage_insert,
+                       daily_artist_plays_stage_create, daily_artist_plays_stage_delete, daily_artist_plays_stage_insert,
+                       daily_user_levels_merge, load_watermark_delete, load_watermark_insert] + rollups_watermark_queries
+# the rollup query and the raw table query of every question of dashboard_queries.py
+dashboard_queries = {'plays_per_hour': (hourly_plays_select, hourly_plays_raw_select),
+                     'top_songs': (top_songs_select, top_songs_raw_select),
+                     'top_artists': (top_artists_select, top_artists_raw_select),
+                     'level_users': (level_users_select, level_users_raw_select)}
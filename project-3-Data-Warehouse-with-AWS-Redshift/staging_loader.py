@@ -0,0 +1,166 @@
+import csv
+import json
+import os
+import re
+import tempfile
+import time
+from urllib.parse import urlparse
+from sql_queries import sliced_copy_table_queries, cluster_slices_select, load_commits_select
+from instrumentation import metrics
+
+
+# Redshift only clauses and their PostgreSQL replacements, used to run the same sql on a local PostgreSQL stand-in
+POSTGRES_REWRITES = [
+    (re.compile(r'identity\(0,\s*1\)', re.IGNORECASE), 'generated by default as identity (minvalue 0 start with 0)'),
+    (re.compile(r'extract\(\s*weekday\s+from', re.IGNORECASE), 'EXTRACT(dow from'),
+]
+
+
+def postgres_sql(query):
+    """Rewrite a Redshift statement into the PostgreSQL statement of the local stand-in"""
+    for pattern, replacement in POSTGRES_REWRITES:
+        query = pattern.sub(replacement, query)
+    return query
+
+
+def list_input_files(url):
+    """List the (url, size in bytes) of every file under an s3:// prefix or a local directory"""
+    parsed = urlparse(url)
+    if parsed.scheme == 's3':
+        import boto3
+        paginator = boto3.client('s3').get_paginator('list_objects_v2')
+        files = []
+        for page in paginator.paginate(Bucket=parsed.netloc, Prefix=parsed.path.lstrip('/')):
+            for obj in page.get('Contents', []):
+                if obj['Size'] > 0:
+                    files.append(('s3://{}/{}'.format(parsed.netloc, obj['Key']), obj['Size']))
+        return files
+
+    files = []
+    for root, dirs, names in os.walk(parsed.path if parsed.scheme == 'file' else url):
+        for name in names:
+            if name.endswith('.json'):
+                path = os.path.abspath(os.path.join(root, name))
+                files.append((path, os.path.getsize(path)))
+    return files
+
+
+def cluster_slices(cur):
+    """Return the number of nodes and slices of the Redshift cluster"""
+    cur.execute(cluster_slices_select)
+    nodes, slices = cur.fetchone()
+    return nodes, slices
+
+
+def slice_aligned_chunks(files, slices, max_files=None):
+    """Split files into the manifests of the load, one COPY per manifest.
+
+    All files go into a single manifest, so a table is loaded by one COPY that keeps every slice busy. Only when there
+    are more than max_files files they are split into manifests of the largest multiple of slices files that fits,
+    so every slice loads the same number of files in every COPY. Files are ordered by size first so the files of a
+    manifest are of similar size. Only the last manifest can be smaller.
+    """
+    files = sorted(files, key=lambda f: f[1], reverse=True)
+    if not max_files or len(files) <= max_files:
+        return [files] if files else []
+    chunk_size = max_files - max_files % slices if max_files >= slices else max_files
+    return [files[i:i + chunk_size] for i in range(0, len(files), chunk_size)]
+
+
+def build_manifest(chunk):
+    """Build the COPY manifest of a chunk of (url, size) files"""
+    return {'entries': [{'url': url, 'mandatory': True, 'meta': {'content_length': size}} for url, size in chunk]}
+
+
+def upload_manifest(manifest, url):
+    """Write a manifest to its s3:// url"""
+    import boto3
+    parsed = urlparse(url)
+    boto3.client('s3').put_object(Bucket=parsed.netloc, Key=parsed.path.lstrip('/'),
+                                  Body=json.dumps(manifest).encode('utf8'))
+
+
+def copy_chunk(cur, conn, copy_query, manifest_url):
+    """COPY one manifest into Redshift and return (files, rows) committed by the load from stl_load_commits"""
+    cur.execute(copy_query.format(manifest_url))
+    conn.commit()
+    cur.execute(load_commits_select)
+    files, rows, first_commit, last_commit = cur.fetchone()
+    return files or 0, rows or 0
+
+
+def csv_value(value):
+    """Format a json value for COPY, NULL is an empty field and whole floats are written as integers for bigint columns"""
+    if value is None:
+        return ''
+    if isinstance(value, float) and value.is_integer():
+        return int(value)
+    return value
+
+
+def copy_chunk_postgres(cur, table, chunk):
+    """Load one chunk of local json files into the PostgreSQL stand-in with COPY FROM STDIN and return (files, rows).
+
+    Json keys are matched to the columns of the staging table by name like JSON 'auto' does. The csv rows are
+    spooled to a temporary file once they pass 64 MB, so a whole table can be loaded with one COPY.
+    """
+    cur.execute("select column_name from information_schema.columns "
+                "where table_name = %s and is_identity = 'NO' order by ordinal_position", (table,))
+    columns = [row[0] for row in cur.fetchall()]
+
+    buffer = tempfile.SpooledTemporaryFile(max_size=64 * 2 ** 20, mode='w+', encoding='utf8', newline='')
+    writer = csv.writer(buffer)
+    rows = 0
+    for path, size in chunk:
+        with open(path, encoding='utf8') as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                record = {key.lower(): csv_value(value) for key, value in json.loads(line).items()}
+                writer.writerow([record.get(c, '') for c in columns])
+                rows += 1
+    buffer.seek(0)
+    cur.copy_expert('COPY {} ({}) FROM STDIN WITH (FORMAT csv)'.format(table, ', '.join(columns)), buffer)
+    buffer.close()
+    return len(chunk), rows
+
+
+def load_staging_tables_sliced(cur, conn, config, target='redshift'):
+    """Load every staging table with one manifest COPY and report duration, rows and bytes of every load.
+
+    The manifest lists all input files of the table, it is only split into slice aligned manifests when the table
+    has more than [LOAD] MAX_MANIFEST_FILES files. On Redshift the slice count comes from stv_slices, the manifests are written under [LOAD] MANIFEST_PREFIX and
+    rows are read back from stl_load_commits. On the PostgreSQL stand-in the slice count is [LOAD] SLICES and the
+    input data is read from the local directories in [LOCAL].
+    """
+    max_files = config.getint('LOAD', 'MAX_MANIFEST_FILES', fallback=0)
+    if target == 'redshift':
+        nodes, slices = cluster_slices(cur)
+    else:
+        nodes, slices = 1, config.getint('LOAD', 'SLICES', fallback=2)
+    print('loading with {} nodes, {} slices'.format(nodes, slices))
+
+    stats = []
+    for table, input_data, copy_query in sliced_copy_table_queries:
+        if target != 'redshift':
+            input_data = config.get('LOCAL', table.upper())
+        chunks = slice_aligned_chunks(list_input_files(input_data), slices, max_files)
+        for i, chunk in enumerate(chunks):
+            size = sum(f[1] for f in chunk)
+            start = time.perf_counter()
+            with metrics.stage('copy ' + table, chunk=i) as counts:
+                if target == 'redshift':
+                    manifest_url = '{}/{}/{:05d}.manifest'.format(config.get('LOAD', 'MANIFEST_PREFIX').rstrip('/'), table, i)
+                    upload_manifest(build_manifest(chunk), manifest_url)
+                    files, rows = copy_chunk(cur, conn, copy_query, manifest_url)
+                else:
+                    files, rows = copy_chunk_postgres(cur, table, chunk)
+                    conn.commit()
+                counts.update(files=files, rows_written=rows, bytes_read=size)
+            duration = time.perf_counter() - start
+            stats.append({'table': table, 'chunk': i, 'files': files, 'rows': rows, 'bytes': size, 'seconds': duration})
+            # the slices that load one file less than the others in the last round of the COPY
+            idle = -len(chunk) % slices
+            print('{} manifest {}: {} files, {} rows, {} bytes in {:.2f}s, {} of {} slices idle in the last round'.format(
+                table, i, files, rows, size, duration, idle, slices))
+    return stats
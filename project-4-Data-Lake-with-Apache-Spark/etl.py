@@ -1,53 +1,471 @@
 import configparser
-from datetime import datetime
-import os
-from pyspark.sql import SparkSession
-from pyspark.sql.functions import udf, col, monotonically_increasing_id, from_unixtime
-from pyspark.sql.functions import year, month, dayofmonth, hour, weekofyear, dayofweek, to_date
-from pyspark.sql.types import IntegerType, TimestampType, DateType
+from datetime import datetime, timedelta
+import argparse
+import json
+import re
+import urllib.error
+import urllib.request
+from pyspark import StorageLevel
+from pyspark.sql import SparkSession, Window
+from pyspark.sql.functions import col, row_number, xxhash64
+from pyspark.sql.functions import year, month, dayofmonth, hour, weekofyear, dayofweek
+from pyspark.sql.functions import broadcast, bround, lower, trim, lit, max as max_
+from pyspark.sql.types import IntegerType, TimestampType
+from pyspark.sql.types import StructType, StructField, StringType, LongType, DoubleType
+from table_writer import write_table, path_exists, glob_files, TARGET_FILE_BYTES
+from instrumentation import metrics
 
 
-config = configparser.ConfigParser()
-config.read('dl.cfg')
+# settings of a spark profile section of dl.cfg and the spark configuration they set,
+# settings that are not in the profile keep the spark defaults
+profile_settings = {
+    'SHUFFLE_PARTITIONS': ['spark.sql.shuffle.partitions'],
+    'ADAPTIVE_EXECUTION': ['spark.sql.adaptive.enabled', 'spark.sql.adaptive.coalescePartitions.enabled'],
+    'SKEW_JOIN': ['spark.sql.adaptive.skewJoin.enabled'],
+    'S3A_FAST_UPLOAD': ['spark.hadoop.fs.s3a.fast.upload'],
+    'S3A_FAST_UPLOAD_BUFFER': ['spark.hadoop.fs.s3a.fast.upload.buffer'],
+    'S3A_COMMITTER': ['spark.hadoop.fs.s3a.committer.name'],
+}
 
-os.environ['AWS_ACCESS_KEY_ID']=config['AWS_ACCESS_KEY_ID']
-os.environ['AWS_SECRET_ACCESS_KEY']=config['AWS_SECRET_ACCESS_KEY']
+# spark configuration of the S3A committers, they need the spark-hadoop-cloud package
+s3a_committer_settings = {
+    'spark.sql.sources.commitProtocolClass': 'org.apache.spark.internal.io.cloud.PathOutputCommitProtocol',
+    'spark.sql.parquet.output.committer.class': 'org.apache.spark.internal.io.cloud.BindingParquetOutputCommitter',
+}
 
+# metrics of a completed stage in the Spark REST api and the names they are logged as
+spark_stage_fields = {
+    'executorRunTime': 'executor_run_ms',
+    'inputBytes': 'bytes_read',
+    'inputRecords': 'rows_read',
+    'outputBytes': 'bytes_written',
+    'outputRecords': 'rows_written',
+    'shuffleReadBytes': 'shuffle_read_bytes',
+    'shuffleWriteBytes': 'shuffle_write_bytes',
+    'memoryBytesSpilled': 'memory_spilled_bytes',
+    'diskBytesSpilled': 'disk_spilled_bytes',
+}
 
-def create_spark_session():
-    spark = SparkSession \
-        .builder \
-        .config("spark.jars.packages", "org.apache.hadoop:hadoop-aws:2.7.0") \
-        .getOrCreate()
+# reasons the stage metrics could not be read that were logged, every reason is logged once
+stage_warnings = set()
+
+# explicit schemas of the song and log data files, without them spark.read.json
+# makes one more pass over every input file to infer the schema
+song_schema = StructType([
+    StructField('num_songs', LongType()),
+    StructField('artist_id', StringType()),
+    StructField('artist_latitude', DoubleType()),
+    StructField('artist_longitude', DoubleType()),
+    StructField('artist_location', StringType()),
+    StructField('artist_name', StringType()),
+    StructField('song_id', StringType()),
+    StructField('title', StringType()),
+    StructField('duration', DoubleType()),
+    StructField('year', LongType())
+])
+
+log_schema = StructType([
+    StructField('artist', StringType()),
+    StructField('auth', StringType()),
+    StructField('firstName', StringType()),
+    StructField('gender', StringType()),
+    StructField('itemInSession', LongType()),
+    StructField('lastName', StringType()),
+    StructField('length', DoubleType()),
+    StructField('level', StringType()),
+    StructField('location', StringType()),
+    StructField('method', StringType()),
+    StructField('page', StringType()),
+    StructField('registration', DoubleType()),
+    StructField('sessionId', LongType()),
+    StructField('song', StringType()),
+    StructField('status', LongType()),
+    StructField('ts', LongType()),
+    StructField('userAgent', StringType()),
+    # logged out events have a blank userId
+    StructField('userId', StringType())
+])
+
+
+def load_config(path='dl.cfg'):
+    '''
+        Read the configuration file of the job
+        Parameters:
+            - path: path of the configuration file
+       Outputs:
+           ConfigParser of the file, empty when the file does not exist
+    '''
+    
+    config = configparser.ConfigParser()
+    config.read(path)
+    return config
+
+def spark_profile(config, profile='SPARK'):
+    '''
+        Spark configuration of a profile section of dl.cfg
+        Parameters:
+            - config: ConfigParser of dl.cfg
+            - profile: name of the profile section
+       Outputs:
+           master url, None for the spark default, and dict of spark configuration
+    '''
+    
+    section = config[profile] if config.has_section(profile) else {}
+    settings = {}
+    # an empty PACKAGES runs without extra packages, like a local profile
+    packages = section.get('PACKAGES', 'org.apache.hadoop:hadoop-aws:2.7.0')
+    if packages:
+        settings['spark.jars.packages'] = packages
+    for key, names in profile_settings.items():
+        if key in section:
+            settings.update({name: section[key] for name in names})
+    if section.get('KRYO', 'false').lower() in ('true', 'yes', 'on', '1'):
+        settings['spark.serializer'] = 'org.apache.spark.serializer.KryoSerializer'
+    if 'S3A_COMMITTER' in section:
+        settings.update(s3a_committer_settings)
+    
+    # the credentials go to the S3A file system of this session instead of the environment
+    if config.has_section('AWS'):
+        settings['spark.hadoop.fs.s3a.access.key'] = config.get('AWS', 'AWS_ACCESS_KEY_ID')
+        settings['spark.hadoop.fs.s3a.secret.key'] = config.get('AWS', 'AWS_SECRET_ACCESS_KEY')
+    return section.get('MASTER'), settings
+
+def create_spark_session(config=None, profile='SPARK'):
+    '''
+        Create the spark session of a profile section of dl.cfg
+        Parameters:
+            - config: ConfigParser of dl.cfg, the spark defaults are used when not given
+            - profile: name of the profile section
+       Outputs:
+           Spark application object
+    '''
+    
+    master, settings = spark_profile(config or configparser.ConfigParser(), profile)
+    builder = SparkSession.builder.appName('sparkify data lake')
+    if master:
+        builder = builder.master(master)
+    for name, value in settings.items():
+        builder = builder.config(name, value)
+    spark = builder.getOrCreate()
     
     return spark
 
-def process_song_data(spark, input_data, output_data):
+def completed_stages(spark):
+    '''
+        List the completed stages of the application from the Spark REST api, the stage
+        data the status listener of the application collected from the task metrics
+        Parameters:
+            - spark: Spark application object
+       Outputs:
+           list of stage dicts, None when the Spark UI is disabled or the REST api
+           can not be reached, a warning is logged then
+    '''
+    
+    if not spark.sparkContext.uiWebUrl:
+        warn_stages_unavailable('spark.ui.enabled is false, the Spark stage metrics are not logged')
+        return None
+    url = '{}/api/v1/applications/{}/stages?status=complete'.format(spark.sparkContext.uiWebUrl, \
+                                                                    spark.sparkContext.applicationId)
+    try:
+        with urllib.request.urlopen(url, timeout=30) as response:
+            return json.load(response)
+    except (urllib.error.URLError, OSError, ValueError) as e:
+        warn_stages_unavailable('the Spark REST api at {} failed ({}), the Spark stage metrics are not logged' \
+                                .format(url, e))
+        return None
+
+def warn_stages_unavailable(message):
+    '''
+        Log a warning that the Spark stage metrics could not be read, once per message,
+        to the metrics log and to stdout
+        Parameters:
+            - message: reason the stage metrics could not be read
+       Outputs:
+           None
+    '''
+    
+    if message in stage_warnings:
+        return
+    stage_warnings.add(message)
+    print('warning: ' + message)
+    metrics.log('warning', message=message)
+
+def job_stats(spark):
+    '''
+        Sum the input bytes and stage time of the completed stages of the application
+        Parameters:
+            - spark: Spark application object
+       Outputs:
+           dict of stages, input_bytes and stage_seconds, None when the Spark UI is disabled
+    '''
+    
+    stages = completed_stages(spark)
+    if stages is None:
+        return None
+    return {'stages': len(stages), \
+            'input_bytes': sum(stage.get('inputBytes', 0) for stage in stages), \
+            'stage_seconds': sum(stage.get('executorRunTime', 0) for stage in stages) / 1000}
+
+def report_job_stats(name, before, after):
+    '''
+        Print the stages, input bytes and stage time of one step of the job
+        Parameters:
+            - name: name of the step
+            - before: job stats before the step
+            - after: job stats after the step
+       Outputs:
+           None
+    '''
+    
+    if before is None or after is None:
+        return
+    print('{}: {} stages, {} input bytes, {:.2f}s stage time'.format(name, after['stages'] - before['stages'], \
+          after['input_bytes'] - before['input_bytes'], after['stage_seconds'] - before['stage_seconds']))
+
+def log_spark_stages(spark, step, logged):
+    '''
+        Log the metrics of every Spark stage completed since the last call, one json line
+        per stage, and sum them
+        Parameters:
+            - spark: Spark application object
+            - step: name of the step of the job the stages ran in
+            - logged: set of the (stage id, attempt id) of the stages logged before,
+                            the stages logged now are added to it
+       Outputs:
+           dict of the summed stage metrics, empty when the stage metrics can not be
+           read, completed_stages logs a warning then
+    '''
+    
+    totals = {}
+    for stage in completed_stages(spark) or []:
+        key = (stage['stageId'], stage.get('attemptId', 0))
+        if key in logged:
+            continue
+        logged.add(key)
+        values = {name: stage.get(field, 0) for field, name in spark_stage_fields.items()}
+        metrics.log('spark_stage', step=step, stage_id=key[0], attempt=key[1], name=stage.get('name'), \
+                    tasks=stage.get('numTasks'), **values)
+        for name, value in values.items():
+            totals[name] = totals.get(name, 0) + value
+    return totals
+
+def read_song_data(spark, input_data, storage_level='MEMORY_AND_DISK'):
+    '''
+        Read the song data files once with the song schema and persist them for
+        the song, artist and songplays tables
+        Parameters:
+            - spark: Spark application object
+            - input_data: Path to base input data
+            - storage_level: name of the pyspark StorageLevel to persist the song data at
+       Outputs:
+           song data dataframe
+    '''
+    
+    # get filepath to song data file
+    song_data = input_data + 'song_data/*/*/*/*'
+    
+    return spark.read.json(song_data, schema=song_schema).persist(getattr(StorageLevel, storage_level))
+
+def read_song_tables(spark, output_data):
+    '''
+        Read the song and artist tables back from their parquet files in the columns
+        of the song data, used when the song data is not shared from process_song_data
+        Parameters:
+            - spark: Spark application object
+            - output_data: Path to base output data
+       Outputs:
+           dataframe with the song_id, title, artist_id, artist_name and duration of every song
+    '''
+    
+    artist_names = spark.read.parquet(output_data + 'artist'). \
+                    select('artist_id', col('name').alias('artist_name')).distinct()
+    return spark.read.parquet(output_data + 'song').join(artist_names, 'artist_id'). \
+                    select('song_id', 'title', 'artist_id', 'artist_name', 'duration')
+
+def join_keys(title, artist, duration):
+    '''
+        Normalized songplays join keys, trimmed and case folded strings and
+        the duration rounded to milliseconds, so float noise and stray spaces
+        in the log data do not lose matches
+        Parameters:
+            - title: song title column
+            - artist: artist name column
+            - duration: song duration column
+       Outputs:
+           list of the title_key, artist_key and duration_key columns
+    '''
+    
+    return [lower(trim(title)).alias('title_key'), lower(trim(artist)).alias('artist_key'), \
+            bround(duration, 3).alias('duration_key')]
+
+def song_join_side(song_df):
+    '''
+        Project the song data down to the join keys and the ids of the songplays
+        table, one row per key
+        Parameters:
+            - song_df: song data dataframe with title, artist_name, duration, song_id and artist_id
+       Outputs:
+           dataframe with title_key, artist_key, duration_key, song_id and artist_id
+    '''
+    
+    # the smallest song_id of a key wins, so a key gets the same song and artist on every
+    # run whatever the order and partitioning of the song data
+    keys = ['title_key', 'artist_key', 'duration_key']
+    smallest = Window.partitionBy(*keys).orderBy('song_id', 'artist_id')
+    return song_df.select(*join_keys(song_df.title, song_df.artist_name, song_df.duration), \
+                          'song_id', 'artist_id'). \
+                    withColumn('rank', row_number().over(smallest)). \
+                    filter(col('rank') == 1).drop('rank')
+
+def estimated_size(df):
+    '''
+        Size in bytes of a dataframe estimated by the Spark optimizer
+        Parameters:
+            - df: dataframe
+       Outputs:
+           estimated size in bytes
+    '''
+    
+    return int(str(df._jdf.queryExecution().optimizedPlan().stats().sizeInBytes()))
+
+def used_broadcast_join(spark, df):
+    '''
+        Tell if the plan that computed a cached dataframe joined with a BroadcastHashJoin.
+        With adaptive execution the final plan of the executed query is checked, the join
+        strategy it switched to at runtime and not the one it planned
+        Parameters:
+            - spark: Spark application object
+            - df: persisted dataframe that was computed by an action
+       Outputs:
+           True when the executed plan has a BroadcastHashJoin, None when the dataframe is not cached
+    '''
+    
+    cached = spark._jsparkSession.sharedState().cacheManager().lookupCachedData(df._jdf)
+    if not cached.isDefined():
+        return None
+    plan = cached.get().cachedRepresentation().cacheBuilder().cachedPlan()
+    if plan.getClass().getSimpleName() == 'AdaptiveSparkPlanExec':
+        plan = plan.executedPlan()
+    return 'BroadcastHashJoin' in plan.toString()
+
+def log_files(spark, input_data, start_date, end_date=None):
+    '''
+        List the log data files of the days from start_date to end_date, the day
+        is taken from the file name like 2018-11-01-events.json
+        Parameters:
+            - spark: Spark application object
+            - input_data: Path to base input data
+            - start_date: first day to read
+            - end_date: last day to read, no limit when not given
+       Outputs:
+           list of log data file paths
+    '''
+    
+    files = []
+    for path in glob_files(spark, input_data + 'log_data/*/*/*'):
+        day = re.search(r'(\d{4}-\d{2}-\d{2})', path.rsplit('/', 1)[-1])
+        if day is None:
+            continue
+        day = datetime.strptime(day.group(1), '%Y-%m-%d').date()
+        if day >= start_date and (end_date is None or day <= end_date):
+            files.append(path)
+    return files
+
+def log_watermark(spark, output_data):
+    '''
+        Day of the latest start_time already in the time table, the next incremental
+        run starts at this day
+        Parameters:
+            - spark: Spark application object
+            - output_data: Path to base output data
+       Outputs:
+           date of the watermark, None when the time table does not exist yet
+    '''
+    
+    if not path_exists(spark, output_data + 'time'):
+        return None
+    watermark = spark.read.parquet(output_data + 'time').agg(max_('start_time')).collect()[0][0]
+    return watermark.date() if watermark is not None else None
+
+def read_start_time_range(spark, path, start_time, end_time):
+    '''
+        Read the rows of the time or songplays table from start_time to end_time. The
+        year/month of the range is added to the filter, so only the partitions of the
+        range are listed and read and the start_time filter skips row groups in them.
+        Parameters:
+            - spark: Spark application object
+            - path: path of the time or songplays table
+            - start_time: first start_time, a datetime
+            - end_time: last start_time, a datetime
+       Outputs:
+           dataframe of the rows in the range
+    '''
+    
+    year_month = col('year') * 100 + col('month')
+    return spark.read.parquet(path). \
+            filter(year_month.between(start_time.year * 100 + start_time.month, \
+                                      end_time.year * 100 + end_time.month)). \
+            filter(col('start_time').between(lit(start_time), lit(end_time)))
+
+def keep_other_days(spark, table, path, start_date, end_date=None):
+    '''
+        Add the rows of the existing year/month partitions of a table that fall
+        outside the processed days, so the dynamic overwrite of a partition keeps
+        them and a rerun of the same days replaces its rows instead of adding them again.
+        The kept rows are read with read_start_time_range, only the partitions of the
+        first and last processed month are read
+        Parameters:
+            - spark: Spark application object
+            - table: new rows of the processed days, partitioned by year and month
+            - path: path of the table
+            - start_date: first processed day
+            - end_date: last processed day, no limit when not given
+       Outputs:
+           dataframe with the new and the kept rows
+    '''
+    
+    if not path_exists(spark, path):
+        return table
+    # the days of the first processed month before start_date and of the last processed month after end_date
+    ranges = []
+    first_day = datetime.combine(start_date, datetime.min.time())
+    if start_date.day > 1:
+        ranges.append((first_day.replace(day=1), first_day - timedelta(microseconds=1)))
+    if end_date is not None and (end_date + timedelta(days=1)).month == end_date.month:
+        after_end = datetime.combine(end_date + timedelta(days=1), datetime.min.time())
+        next_month = (after_end.replace(day=1) + timedelta(days=32)).replace(day=1)
+        ranges.append((after_end, next_month - timedelta(microseconds=1)))
+    for start_time, end_time in ranges:
+        table = table.unionByName(read_start_time_range(spark, path, start_time, end_time))
+    return table
+
+def process_song_data(spark, input_data, output_data, storage_level='MEMORY_AND_DISK', \
+                      target_file_bytes=TARGET_FILE_BYTES):
     '''
         Process song data into song and artist tables
         Parameters:
             - spark: Spark application object
             - input_data: Path to base input data
             - output_data: Path to base output data
-            - song_data: path to song data files
+            - storage_level: name of the pyspark StorageLevel to persist the song data at
+            - target_file_bytes: target size of the written parquet files
             - df: song data dataframe
             - songs_table: dataframe that holds the song table records
             - artists_table: dataframe that holds the artist table records
        Outputs:
-           None
+           the persisted song data dataframe, to be shared with process_log_data
+           and unpersisted by the caller
     '''
     
-    # get filepath to song data file
-    song_data = input_data + 'song_data/*/*/*/*'
-    
     # read song data file
-    df = spark.read.json(song_data)
+    df = read_song_data(spark, input_data, storage_level)
     
     # extract columns to create songs table
     songs_table = df.select('song_id', 'title', 'artist_id', 'year', 'duration').dropDuplicates()
     
-    # write songs table to parquet files partitioned by year and artist
-    songs_table.write.partitionBy('year','artist_id').parquet(output_data + 'song', mode='overwrite')
+    # write songs table to parquet files partitioned by year and artist, as far as
+    # the partitions still make files of the target size
+    write_table(spark, songs_table, output_data + 'song', ['year', 'artist_id'], 0, target_file_bytes)
     
     # extract columns to create artists table
     artists_table = df.select('artist_id', col('artist_name').alias('name'), col('artist_location'). \
@@ -55,93 +473,198 @@ def process_song_data(spark, input_data, output_data):
                                    col('artist_longitude').alias('longitude')).dropDuplicates()
     
     # write artists table to parquet files
-    artists_table.write.parquet(output_data + 'artist', mode='overwrite')
+    write_table(spark, artists_table, output_data + 'artist', target_file_bytes=target_file_bytes)
     
-def process_log_data(spark, input_data, output_data):
+    return df
+    
+def process_log_data(spark, input_data, output_data, song_df=None, broadcast_threshold=10485760, \
+                     target_file_bytes=TARGET_FILE_BYTES, start_date=None, end_date=None):
     '''
         Process log data into users, time and songplay tables
         Parameters:
             - spark: Spark application object
             - input_data: Path to base input data
             - output_data: Path to base output data
+            - song_df: song data dataframe returned by process_song_data, the song
+                            and artist tables are read back from output_data when not given
+            - broadcast_threshold: largest estimated size in bytes of the song side of the
+                            songplays join that is broadcast to the executors
+            - target_file_bytes: target size of the written parquet files
+            - start_date: first day of log data to process, all log data is processed
+                            and the tables rebuilt when not given
+            - end_date: last day of log data to process, no limit when not given
             - log_data: path to log data files
             - df: log data dataframe
-            - users_temp: dataframe to store the most recent timestamp (login)
-                            for every unique user in log data
+            - latest: window that orders the records of every user by
+                            timestamp (login), most recent first
             - users: dataframe that holds the user table records
             - time_table: dataframe that holds the time table records
-            - song_data: path to song data files
-            - song_df: song data dataframe
+            - songs: song side of the songplays join, one row per join key
             - songplays_table: dataframe that holds the songplats table records
        Outputs:
-           None
+           dict of the events, matched events, match rate and broadcast join of the songplays join,
+           None when there is no log data to process
     '''
     
-    # get filepath to log data file
-    log_data = input_data + 'log_data/*/*/*'
+    # get filepath to log data file, only the files of the processed days in incremental mode
+    incremental = start_date is not None
+    if incremental:
+        log_data = log_files(spark, input_data, start_date, end_date)
+        print('processing {} log files from {} to {}'.format(len(log_data), start_date, end_date or 'the end'))
+        if not log_data:
+            return None
+    else:
+        log_data = input_data + 'log_data/*/*/*'
 
     # read log data file
-    df = spark.read.json(log_data)
+    df = spark.read.json(log_data, schema=log_schema)
     
     # filter by actions for song plays
     df = df.filter(df.page == 'NextSong')
     
-    # create a temp user data frame that contains the most recent timestamp 
-    # corresponding to every userId except the blank userId (usedId == '')
-    users_temp = df.filter(df.userId != ''). \
-                    groupBy('userId'). \
-                    max('ts'). \
-                    select('userId', col('max(ts)').alias('max_ts'))
+    # keep the most recent record of every userId except the blank userId (usedId == '')
+    # in a single pass, ts ties keep one row
+    latest = Window.partitionBy('userId').orderBy(col('ts').desc())
     
     # extract columns for users table    
-    users_table = df.join(users_temp, [df.userId == users_temp.userId, df.ts == users_temp.max_ts]). \
-                    select(df.userId.alias('user_id'), df.firstName.alias('first_name'), \
-                    df.lastName.alias('last_name'), df.gender, df.level)
+    users_table = df.filter(df.userId != ''). \
+                    withColumn('recency', row_number().over(latest)). \
+                    filter(col('recency') == 1). \
+                    select(col('userId').alias('user_id'), col('firstName').alias('first_name'), \
+                    col('lastName').alias('last_name'), 'gender', 'level', 'ts')
     # cast user_id column from string to int
     users_table = users_table.withColumn('user_id', users_table['user_id'].cast(IntegerType()))
     
-    # write users table to parquet files
-    users_table.write.partitionBy('user_id').parquet(output_data + 'users', mode='overwrite')
+    # merge with the existing users by latest ts instead of rebuilding them
+    if incremental and path_exists(spark, output_data + 'users'):
+        users_table = users_table.unionByName(spark.read.parquet(output_data + 'users'), allowMissingColumns=True). \
+                        withColumn('recency', row_number().over(Window.partitionBy('user_id'). \
+                                                                orderBy(col('ts').desc_nulls_last()))). \
+                        filter(col('recency') == 1).drop('recency')
+        # the merged users are read from the table they overwrite, cut the lineage
+        # so the write does not read the files it replaces
+        users_table = users_table.localCheckpoint()
     
-    # create timestamp column from original timestamp column
-    df = df.withColumn('timestamp', from_unixtime(df.ts/1000).cast(TimestampType()))
+    # write users table to parquet files, partitioned by user_id only when every
+    # user would fill a file of the target size
+    write_table(spark, users_table, output_data + 'users', ['user_id'], 0, target_file_bytes)
     
-    # create datetime column from original timestamp column
-    df = df.withColumn('datetime', from_unixtime(df.ts/1000).cast(DateType()))
+    # create start_time column from original timestamp column, converted once with
+    # its milliseconds for both the time and the songplays table
+    df = df.withColumn('start_time', (df.ts / 1000).cast(TimestampType()))
     
-    # extract columns to create time table
-    time_table = df.select(df.timestamp.alias('start_time'), hour('timestamp').alias('hour'), \
-                       dayofmonth('timestamp').alias('day'), weekofyear('timestamp').alias('week'), \
-                       month('timestamp').alias('month'), year('timestamp').alias('year'), \
-                       dayofweek('timestamp').alias('weekday'))
+    # extract columns to create time table, one row per distinct start_time
+    time_table = df.select('start_time').distinct()
+    time_table = time_table.select('start_time', hour('start_time').alias('hour'), \
+                       dayofmonth('start_time').alias('day'), weekofyear('start_time').alias('week'), \
+                       month('start_time').alias('month'), year('start_time').alias('year'), \
+                       dayofweek('start_time').alias('weekday'))
     
-    # write time table to parquet files partitioned by year and month
-    time_table.write.partitionBy('year', 'month').parquet(output_data + 'time', mode='overwrite')
+    # write time table to parquet files partitioned by year and month, in incremental
+    # mode only the year/month partitions of the processed days are replaced and start_times
+    # already in them are not added again
+    if incremental:
+        time_table = keep_other_days(spark, time_table, output_data + 'time', start_date, end_date). \
+                        dropDuplicates(['start_time'])
+    write_table(spark, time_table, output_data + 'time', ['year', 'month'], 2, target_file_bytes, \
+                dynamic=incremental, sort_cols=['start_time'])
     
-    # read in song data to use for songplays table
-    song_data = input_data + 'song_data/*/*/*/*'
-    song_df = spark.read.json(song_data)
+    # song data to use for songplays table, the files are not read a second time
+    if song_df is None:
+        song_df = read_song_tables(spark, output_data)
+    
+    # song side of the join, small enough to be broadcast it avoids shuffling the log data
+    songs = song_join_side(song_df)
+    song_side_bytes = estimated_size(songs)
+    if song_side_bytes <= broadcast_threshold:
+        songs = broadcast(songs)
     
     # extract columns from joined song and log datasets to create songplays table 
-    songplays_table = df.join(song_df, (song_df.title == df.song) & \
-                        (song_df.artist_name == df.artist) & \
-                        (song_df.duration == df.length), 'inner'). \
-                        select(monotonically_increasing_id().alias('songplay_id'), \
-                        df.timestamp.alias('start_time'), df.userId.alias('user_id'), \
-                        df.level, song_df.song_id, song_df.artist_id, df.sessionId.alias('session_id'), \
-                        df.location, df.userAgent.alias('user_agent'), year(df.timestamp).alias('year'), \
-                        month(df.timestamp).alias('month'))
+    # songplay_id is a hash of the event, the same event always gets the same id, so the ids of the rows an
+    # incremental run adds do not collide with the rows it keeps and a rerun of a day keeps its ids
+    events = df.select('*', *join_keys(df.song, df.artist, df.length))
+    songplays_table = events.join(songs, ['title_key', 'artist_key', 'duration_key'], 'inner'). \
+                        select(xxhash64(events.ts, events.userId, events.sessionId, events.itemInSession). \
+                        alias('songplay_id'), \
+                        events.start_time, events.userId.alias('user_id'), \
+                        events.level, songs.song_id, songs.artist_id, events.sessionId.alias('session_id'), \
+                        events.location, events.userAgent.alias('user_agent'), year(events.start_time).alias('year'), \
+                        month(events.start_time).alias('month'))
 
+    # the songplays of the processed days are cached, the join runs once for the match count
+    # and the write, also when the kept days are added to them in incremental mode
+    new_songplays = songplays_table.persist(StorageLevel.MEMORY_AND_DISK)
+    matched = new_songplays.count()
+    # join strategy of the plan that just computed the songplays, before the write unpersists them
+    broadcast_join = used_broadcast_join(spark, new_songplays)
+    
     # write songplays table to parquet files partitioned by year and month
-    songplays_table.write.partitionBy('year', 'month').parquet(output_data + 'songplays', mode='overwrite')
+    if incremental:
+        songplays_table = keep_other_days(spark, new_songplays, output_data + 'songplays', start_date, end_date)
+    write_table(spark, songplays_table, output_data + 'songplays', ['year', 'month'], 2, \
+                target_file_bytes, dynamic=incremental, sort_cols=['start_time'])
+    
+    # share of the song plays that were matched to a song
+    event_count = df.count()
+    join_stats = {'events': event_count, 'matched': matched, \
+                  'match_rate': matched / event_count if event_count else 0.0, \
+                  'song_side_bytes': song_side_bytes, 'broadcast': broadcast_join}
+    print('songplays join: {matched} of {events} song plays matched ({match_rate:.1%}), '
+          'song side {song_side_bytes} bytes, broadcast hash join: {broadcast}'.format(**join_stats))
+    new_songplays.unpersist()
+    return join_stats
     
 def main():
-    spark = create_spark_session()
-    input_data = "s3a://udacity-dend/"
-    output_data = 's3a://analyticstables/analytics/'
+    parser = argparse.ArgumentParser(description='Load the Sparkify data lake tables')
+    parser.add_argument('--input', default='s3a://udacity-dend/',
+                        help='base path of the song_data and log_data, s3a:// or a local file:// directory')
+    parser.add_argument('--output', default='s3a://analyticstables/analytics/',
+                        help='base path of the tables, s3a:// or a local file:// directory')
+    parser.add_argument('--config', default='dl.cfg', help='configuration file')
+    parser.add_argument('--profile', default='SPARK', help='section of the configuration file with the spark profile')
+    parser.add_argument('--start-date', help='process the log data from this day (YYYY-MM-DD) on and '
+                        'replace only its year/month partitions')
+    parser.add_argument('--end-date', help='last day (YYYY-MM-DD) of log data to process')
+    parser.add_argument('--incremental', action='store_true',
+                        help='process the log data from the day of the latest start_time in the time table on')
+    parser.add_argument('--metrics-log', help='file of the json stage logs, stderr when not given')
+    parser.add_argument('--prometheus-file', help='write the stage totals to this Prometheus text file')
+    args = parser.parse_args()
+    metrics.configure('p4_etl', args.metrics_log, args.prometheus_file)
+    
+    start_date = datetime.strptime(args.start_date, '%Y-%m-%d').date() if args.start_date else None
+    end_date = datetime.strptime(args.end_date, '%Y-%m-%d').date() if args.end_date else None
+    
+    config = load_config(args.config)
+    spark = create_spark_session(config, args.profile)
+    input_data = args.input.rstrip('/') + '/'
+    output_data = args.output.rstrip('/') + '/'
+    
+    storage_level = config.get('ETL', 'SONG_STORAGE_LEVEL', fallback='MEMORY_AND_DISK')
+    broadcast_threshold = config.getint('ETL', 'BROADCAST_THRESHOLD', fallback=10485760)
+    target_file_bytes = config.getint('ETL', 'TARGET_FILE_BYTES', fallback=TARGET_FILE_BYTES)
+    
+    if args.incremental and start_date is None:
+        start_date = log_watermark(spark, output_data)
+    
+    # the Spark stages of every step are logged and summed into the step
+    logged = set()
+    stats = job_stats(spark)
+    with metrics.stage('process_song_data') as counts:
+        song_df = process_song_data(spark, input_data, output_data, storage_level, target_file_bytes)
+        counts.update(log_spark_stages(spark, 'process_song_data', logged))
+    song_stats = job_stats(spark)
+    report_job_stats('process_song_data', stats, song_stats)
     
-    process_song_data(spark, input_data, output_data)    
-    process_log_data(spark, input_data, output_data)
+    with metrics.stage('process_log_data') as counts:
+        join_stats = process_log_data(spark, input_data, output_data, song_df, broadcast_threshold, \
+                                      target_file_bytes, start_date, end_date)
+        counts.update(log_spark_stages(spark, 'process_log_data', logged))
+        if join_stats:
+            counts['matched'] = join_stats['matched']
+    report_job_stats('process_log_data', song_stats, job_stats(spark))
+    song_df.unpersist()
+    metrics.write_prometheus()
     
 if __name__ == "__main__":
     main()
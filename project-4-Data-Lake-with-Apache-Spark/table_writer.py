@@ -0,0 +1,177 @@
+import math
+from pyspark import StorageLevel
+from instrumentation import metrics
+
+
+# parquet bytes written per byte of the default row size of the schema, the default
+# size is about the uncompressed size of a row and parquet compresses it about four times
+PARQUET_SIZE_RATIO = 0.25
+
+# default target size of the written parquet files, the writer aims for files
+# between half and twice the target
+TARGET_FILE_BYTES = 256 * 1024 * 1024
+
+
+def choose_partitioning(df, partition_cols, required_cols, table_bytes, min_file_bytes):
+    '''
+        Drop the finest partition columns while the average partition would be
+        smaller than the smallest wanted file
+        Parameters:
+            - df: dataframe to write
+            - partition_cols: partition columns, coarsest first
+            - required_cols: number of leading partition columns that are always kept
+            - table_bytes: expected parquet size of the dataframe
+            - min_file_bytes: smallest wanted file size
+       Outputs:
+           list of partition columns and the number of partitions they make
+    '''
+
+    cols = list(partition_cols)
+    while True:
+        partitions = df.select(*cols).distinct().count() if cols else 1
+        if len(cols) <= required_cols or table_bytes / max(partitions, 1) >= min_file_bytes:
+            return cols, partitions
+        cols.pop()
+
+def hadoop_path(spark, path):
+    '''
+        Hadoop Path and FileSystem of a path
+        Parameters:
+            - spark: Spark application object
+            - path: s3a:// or file:// path
+       Outputs:
+           Path and FileSystem java objects
+    '''
+
+    table_path = spark.sparkContext._jvm.org.apache.hadoop.fs.Path(path)
+    return table_path, table_path.getFileSystem(spark.sparkContext._jsc.hadoopConfiguration())
+
+def path_exists(spark, path):
+    '''
+        Tell if a path exists
+        Parameters:
+            - spark: Spark application object
+            - path: s3a:// or file:// path
+       Outputs:
+           True when the path exists
+    '''
+
+    table_path, fs = hadoop_path(spark, path)
+    return fs.exists(table_path)
+
+def glob_files(spark, pattern):
+    '''
+        List the files matching a glob pattern
+        Parameters:
+            - spark: Spark application object
+            - pattern: s3a:// or file:// glob pattern
+       Outputs:
+           list of matching file paths
+    '''
+
+    glob_path, fs = hadoop_path(spark, pattern)
+    statuses = fs.globStatus(glob_path) or []
+    return [status.getPath().toString() for status in statuses if status.isFile()]
+
+def list_parquet_files(spark, path):
+    '''
+        List the sizes of the parquet files under a path of any Hadoop file system
+        Parameters:
+            - spark: Spark application object
+            - path: table path, s3a:// or file://
+       Outputs:
+           list of file sizes in bytes
+    '''
+
+    table_path, fs = hadoop_path(spark, path)
+    files = fs.listFiles(table_path, True)
+    sizes = []
+    while files.hasNext():
+        status = files.next()
+        if status.getPath().getName().endswith('.parquet'):
+            sizes.append(status.getLen())
+    return sizes
+
+def file_size_report(sizes, target_file_bytes):
+    '''
+        Summarize the file count and size distribution of a written table
+        Parameters:
+            - sizes: file sizes in bytes
+            - target_file_bytes: target file size of the table
+       Outputs:
+           dict of files, total, min, median and max bytes and the number of files
+           below, in and above the half to twice the target range
+    '''
+
+    sizes = sorted(sizes)
+    low, high = target_file_bytes / 2, target_file_bytes * 2
+    return {'files': len(sizes), 'total_bytes': sum(sizes), \
+            'min_bytes': sizes[0] if sizes else 0, \
+            'median_bytes': sizes[len(sizes) // 2] if sizes else 0, \
+            'max_bytes': sizes[-1] if sizes else 0, \
+            'small_files': sum(1 for s in sizes if s < low), \
+            'target_files': sum(1 for s in sizes if low <= s <= high), \
+            'large_files': sum(1 for s in sizes if s > high)}
+
+def write_table(spark, df, path, partition_cols=(), required_cols=0, target_file_bytes=TARGET_FILE_BYTES, \
+                mode='overwrite', dynamic=False, sort_cols=()):
+    '''
+        Write a table to parquet files close to a target file size and report the
+        files it produced. Partition columns that would make partitions smaller than
+        half the target are dropped, finest first, the rows are repartitioned by the
+        remaining partition columns so every partition is written by one task and
+        files are split at the number of records of the target size.
+        Parameters:
+            - spark: Spark application object
+            - df: dataframe to write
+            - path: table path
+            - partition_cols: partition columns, coarsest first
+            - required_cols: number of leading partition columns that are always kept,
+                            the partitions readers prune on
+            - target_file_bytes: target parquet file size in bytes
+            - mode: save mode of the write
+            - dynamic: overwrite only the partitions the dataframe has rows for
+            - sort_cols: columns the rows of every file are sorted by, the parquet row group
+                            statistics of sorted columns let readers skip row groups
+       Outputs:
+           file size report of the written table
+    '''
+
+    table_name = path.rstrip('/').split('/')[-1]
+    with metrics.stage('write ' + table_name) as counts:
+        # the rows are counted, their partitions listed and then written, cache them once
+        # instead of computing the table three times
+        df = df.persist(StorageLevel.MEMORY_AND_DISK)
+        # a failed write must not keep the cached blocks for the retry
+        try:
+            rows = df.count()
+            # the optimizer size estimate of a join is the product of its sides, the default
+            # row size of the schema times the rows is closer
+            table_bytes = rows * df._jdf.schema().defaultSize() * PARQUET_SIZE_RATIO
+            cols, partitions = choose_partitioning(df, partition_cols, required_cols, table_bytes, target_file_bytes / 2)
+
+            # one task per file of the table, at most one task per partition when partitioned
+            files = max(1, math.ceil(table_bytes / target_file_bytes))
+            tasks = min(files, partitions) if cols else files
+            records_per_file = max(1, int(target_file_bytes / max(table_bytes / max(rows, 1), 1)))
+
+            # sorting by the partition columns first keeps the sort, the writer needs rows ordered by partition
+            table = df.repartition(tasks, *cols)
+            if sort_cols:
+                table = table.sortWithinPartitions(*(cols + list(sort_cols)))
+            writer = table.write.option('maxRecordsPerFile', records_per_file)
+            if cols:
+                writer = writer.partitionBy(*cols)
+            if dynamic:
+                writer = writer.option('partitionOverwriteMode', 'dynamic')
+            writer.parquet(path, mode=mode)
+        finally:
+            df.unpersist()
+
+        report = file_size_report(list_parquet_files(spark, path), target_file_bytes)
+        report.update({'table': table_name, 'partition_cols': cols, 'rows': rows})
+        counts.update(rows_written=rows, bytes_written=report['total_bytes'], files=report['files'])
+    print('{table}: {rows} rows in {files} files partitioned by {partition_cols}, {total_bytes} bytes, '
+          'file size min {min_bytes} median {median_bytes} max {max_bytes}, '
+          '{small_files} small, {target_files} on target, {large_files} large'.format(**report))
+    return report